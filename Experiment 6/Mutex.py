@@ -1,122 +1,138 @@
 import threading
-import socket
-from time import sleep, time
+import random
+from time import time, sleep
 from sys import maxsize
+from peer_channel import PeerChannel
+
+# --- RETRY CONFIGURATION ---
+RETRY_BACKOFF = 0.05     # Seconds to wait before the first retry after a DIE
+MAX_RETRY_BACKOFF = 2.0  # Ceiling for the exponential retry delay
 
 class RicAgra:
-    # --- STATE VARIABLES ---
-    IN_FLAG = False      # True if we are in or want to enter the CS
-    ABORTED = False      # True if we received a "DIE" message
-    IN_TIME = maxsize    # Timestamp of our request to enter the CS
-    IN_QUEUE = []        # Queue for deferred requests (from older processes)
-    OK_COUNT = 0         # Counter for received OK messages
-    port = 0
-    BIRTH_TIME = 0       # Unique timestamp for process age
-
-    def __init__(self, port):
+    """
+    Ricart-Agrawala mutual exclusion with Wait-Die deadlock prevention.
+
+    All protocol state is guarded by one lock. Messages travel over persistent
+    framed connections, and the channel's reader threads signal a condition
+    variable whenever an OK or DIE arrives, so enter_CS reacts immediately.
+    """
+
+    def __init__(self, port, retry_backoff=RETRY_BACKOFF, max_retry_backoff=MAX_RETRY_BACKOFF):
         """Initializes the process and starts its listening daemon."""
+        # --- STATE VARIABLES ---
         self.port = port
-        self.BIRTH_TIME = time()  # Set birth time at initialization
-        ra_deamon = threading.Thread(target=self.ric_agra_deamon, args=[port,], daemon=True)
-        ra_deamon.start()
+        self.IN_FLAG = False      # True if we are in or want to enter the CS
+        self.ABORTED = False      # True if we received a "DIE" message
+        self.IN_TIME = maxsize    # Timestamp of our request to enter the CS
+        self.IN_QUEUE = []        # Queue for deferred requests (from older processes)
+        self.OK_COUNT = 0         # Counter for received OK messages
+        self.BIRTH_TIME = time()  # Unique timestamp for process age
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.state_lock = threading.Lock()
+        self.reply_received = threading.Condition(self.state_lock)
+        self.channel = PeerChannel(port, self.handle_message)
 
     # --- SENDER METHODS ---
     def _send_message(self, port, message):
         """A helper function to send a message to a specific port."""
         try:
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client_socket.connect(('localhost', port))
-            client_socket.sendall(message.encode())
-            client_socket.close()
-        except ConnectionRefusedError:
+            self.channel.send(port, message)
+        except OSError:
             print(f"[{self.port}] Connection to {port} refused.")
 
+    # Replies echo the timestamp of the request they answer, so a late reply to
+    # an aborted attempt is never counted towards the next one.
     def send_ok(self, addr):
         """Sends an OK message."""
         print(f"[{self.port}] Sending OK to {addr[1]}")
-        self._send_message(addr[1], 'OK')
+        self._send_message(addr[1], f"OK#{addr[2]}")
 
     def send_die(self, addr):
         """Sends a DIE message."""
         print(f"[{self.port}] Sending DIE to {addr[1]}")
-        self._send_message(addr[1], 'DIE')
-
-    # --- LISTENING DAEMON ---
-    def ric_agra_deamon(self, port=3000):
-        """Starts the server that listens for incoming requests from other processes."""
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.bind(('0.0.0.0', port))
-        server_socket.listen(5)
-        while True:
-            conn, _ = server_socket.accept()
-            data = conn.recv(1024)
-            conn.close()
-
-            if not data:
-                continue
-            
-            request = data.decode()
-
-            if request.startswith("REQ"):
-                parts = request.split("#")
-                incoming_time = float(parts[1])
-                incoming_port = int(parts[2])
-                incoming_birth = float(parts[3])
-                addr = ['localhost', incoming_port]
-
+        self._send_message(addr[1], f"DIE#{addr[2]}")
+
+    # --- MESSAGE HANDLER ---
+    def handle_message(self, request):
+        """Handles one REQ, OK or DIE message from another process."""
+        if request.startswith("REQ"):
+            parts = request.split("#")
+            incoming_port = int(parts[2])
+            incoming_birth = float(parts[3])
+            addr = ['localhost', incoming_port, parts[1]]
+
+            with self.state_lock:
+                reply = "OK"
                 if self.IN_FLAG:
                     # Wait-Die Algorithm: older process waits, younger dies
                     if incoming_birth < self.BIRTH_TIME:
                         print(f"[{self.port}] Deferring request from older process {incoming_port}")
                         self.IN_QUEUE.append(addr)
+                        reply = None
                     else:
                         print(f"[{self.port}] Denying request from younger process {incoming_port}")
-                        self.send_die(addr)
+                        reply = "DIE"
+            if reply == "OK":
+                self.send_ok(addr)
+            elif reply == "DIE":
+                self.send_die(addr)
+
+        elif request.startswith("OK") or request.startswith("DIE"):
+            kind, request_time = request.split("#")
+            with self.reply_received:
+                if request_time != str(self.IN_TIME):
+                    return # A reply to an attempt we already gave up on
+                if kind == "OK":
+                    self.OK_COUNT += 1
+                    print(f"[{self.port}] OK received. Count: {self.OK_COUNT}")
                 else:
-                    self.send_ok(addr)
-
-            elif request.startswith("OK"):
-                self.OK_COUNT += 1
-                print(f"[{self.port}] OK received. Count: {self.OK_COUNT}")
-
-            elif request.startswith("DIE"):
-                print(f"[{self.port}] DIE received. Aborting request.")
-                self.ABORTED = True
+                    print(f"[{self.port}] DIE received. Aborting request.")
+                    self.ABORTED = True
+                self.reply_received.notify_all()
 
     # --- MUTUAL EXCLUSION API ---
     def enter_CS(self, ip_list=[3001, 3002, 3003]):
         """Requests entry to the Critical Section using Wait-Die algorithm."""
         peers = [p for p in ip_list if p != self.port]
-        
+        attempt = 0
+
         while True:
-            self.IN_TIME = time()
-            self.IN_FLAG = True
-            self.ABORTED = False
-            self.OK_COUNT = 0
-            self.IN_QUEUE = []
+            with self.state_lock:
+                self.IN_TIME = time()
+                self.IN_FLAG = True
+                self.ABORTED = False
+                self.OK_COUNT = 0
+                request_msg = f"REQ#{self.IN_TIME}#{self.port}#{self.BIRTH_TIME}"
 
             print(f"[{self.port}] Requesting CS with timestamp: {self.IN_TIME}")
-            request_msg = f"REQ#{self.IN_TIME}#{self.port}#{self.BIRTH_TIME}"
             for p_port in peers:
                 self._send_message(p_port, request_msg)
 
-            while self.OK_COUNT < len(peers):
-                if self.ABORTED:
-                    print(f"[{self.port}] Request aborted. Retrying after a short delay...")
-                    sleep(10)
-                    break
-                sleep(0.1)
+            with self.reply_received:
+                self.reply_received.wait_for(lambda: self.ABORTED or self.OK_COUNT >= len(peers))
+                aborted = self.ABORTED
 
-            if self.ABORTED:
-                continue
-            else:
+            if not aborted:
                 print(f"[{self.port}] All OKs received. Entering Critical Section.")
                 break
 
+            # Dying means giving up the request entirely, including the older
+            # processes we deferred, before trying again.
+            self._release()
+            attempt += 1
+            delay = min(self.max_retry_backoff, self.retry_backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"[{self.port}] Request aborted. Retrying in {delay:.2f}s...")
+            sleep(delay)
+
     def exit_CS(self):
         """Exits the Critical Section and grants permission to waiting processes."""
         print(f"[{self.port}] Exiting Critical Section.")
-        self.IN_FLAG = False
-        for addr in self.IN_QUEUE:
+        self._release()
+
+    def _release(self):
+        with self.state_lock:
+            self.IN_FLAG = False
+            deferred, self.IN_QUEUE = self.IN_QUEUE, []
+        for addr in deferred:
             self.send_ok(addr)
-        self.IN_QUEUE = []
@@ -0,0 +1,128 @@
+import socket
+import struct
+import threading
+
+# --- Channel Configuration ---
+# Every message is a 4-byte big-endian length followed by a UTF-8 body, so
+# messages are never merged or split by TCP, however they arrive.
+HEADER = struct.Struct("!I")
+MAX_MESSAGE_SIZE = 64 * 1024
+LISTEN_BACKLOG = 64       # Pending connections the listener queues before refusing
+CONNECT_TIMEOUT = 5       # Seconds to wait when opening a connection to a peer
+
+
+def read_message(rfile):
+    """Reads one framed message. Returns None when the connection closes."""
+    header = rfile.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    (length,) = HEADER.unpack(header)
+    if length > MAX_MESSAGE_SIZE:
+        raise ConnectionError(f"Message of {length} bytes exceeds the {MAX_MESSAGE_SIZE} byte limit")
+    body = rfile.read(length)
+    if len(body) < length:
+        return None
+    return body.decode()
+
+
+class PeerChannel:
+    """
+    Message passing between processes that each listen on their own port.
+
+    A process keeps one long-lived outgoing connection per peer, opened on the
+    first send and reopened after it breaks, and reads every incoming
+    connection on its own thread. Messages from one sender arrive in the order
+    they were sent; on_message(message) is called for each of them.
+    """
+    def __init__(self, port, on_message, host='localhost'):
+        self.port = port
+        self.host = host
+        self.on_message = on_message
+        self.connections = {}  # peer port -> socket
+        self.send_locks = {}
+        self.messages_sent = 0
+        self.lock = threading.Lock()
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind(('0.0.0.0', port))
+        self.server_socket.listen(LISTEN_BACKLOG)
+        acceptor = threading.Thread(target=self.accept_loop, daemon=True)
+        acceptor.start()
+
+    # --- Receiving ---
+    def accept_loop(self):
+        while True:
+            conn, _ = self.server_socket.accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            reader = threading.Thread(target=self.read_loop, args=(conn,), daemon=True)
+            reader.start()
+
+    def read_loop(self, conn):
+        rfile = conn.makefile('rb')
+        try:
+            while True:
+                message = read_message(rfile)
+                if message is None:
+                    break
+                self.on_message(message)
+        except (ConnectionError, OSError) as e:
+            print(f"[{self.port}] Dropping peer connection: {e}")
+        finally:
+            rfile.close()
+            conn.close()
+
+    # --- Sending ---
+    def _connect(self, peer_port):
+        conn = socket.create_connection((self.host, peer_port), timeout=CONNECT_TIMEOUT)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.settimeout(None)
+        # Peers never write back on this connection; the watcher only notices when it closes.
+        watcher = threading.Thread(target=self._watch, args=(peer_port, conn), daemon=True)
+        watcher.start()
+        return conn
+
+    def _watch(self, peer_port, conn):
+        try:
+            while conn.recv(1024):
+                pass
+        except OSError:
+            pass
+        self._drop(peer_port, conn)
+
+    def _drop(self, peer_port, conn):
+        with self.lock:
+            if self.connections.get(peer_port) is conn:
+                del self.connections[peer_port]
+        conn.close()
+
+    def send(self, peer_port, message):
+        """Sends one message to the peer listening on peer_port. Raises OSError if it cannot be delivered."""
+        body = message.encode()
+        frame = HEADER.pack(len(body)) + body
+        with self.lock:
+            send_lock = self.send_locks.setdefault(peer_port, threading.Lock())
+        with send_lock:
+            # A cached connection may have died since it was last used; reconnect once before giving up.
+            for attempt in range(2):
+                with self.lock:
+                    conn = self.connections.get(peer_port)
+                if conn is None:
+                    conn = self._connect(peer_port)
+                    with self.lock:
+                        self.connections[peer_port] = conn
+                try:
+                    conn.sendall(frame)
+                    with self.lock:
+                        self.messages_sent += 1
+                    return
+                except OSError:
+                    self._drop(peer_port, conn)
+                    if attempt == 1:
+                        raise
+
+    def close(self):
+        self.server_socket.close()
+        with self.lock:
+            connections, self.connections = self.connections, {}
+        for conn in connections.values():
+            conn.close()
@@ -4,9 +4,13 @@ import random
 from time import time,ctime,sleep
 import threading
 
+DEFAULT_SLAVES = [('localhost', 4001), ('localhost', 4002), ('localhost', 4003)]
+
 class CAF_Clock:
     CAF = 0
-    def __init__(self,port):
+    def __init__(self,port,peers=None):
+        # peers() returns the (host, port) clock daemons to average over, this one first
+        self.peers = peers or (lambda: DEFAULT_SLAVES)
         
         send_deamon=threading.Thread(target=self.time_send_daemon,daemon=True,args=(port,))
         get_deamon=threading.Thread(target=self.time_get_daemon,daemon=True)
@@ -39,13 +43,15 @@ class CAF_Clock:
     def time_get_daemon(self):
         while True:
             sleep(random.randint(1,10))
-            slave_list=[4001,4002,4003]
+            slave_list=self.peers()
             cv_list=[]
-            for slave in slave_list:
+            for host, slave in slave_list:
                 try:
-                    cv_list.append(self.cv_get(port=slave))
+                    cv_list.append(self.cv_get(host=host, port=slave))
                 except Exception  as e:
                     print('Could not connect to a node ',slave,e)
+            if not cv_list:
+                continue
             
             avg_cv = sum(cv_list)/len(cv_list)
             
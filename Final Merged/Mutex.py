@@ -1,102 +1,270 @@
+import itertools
 import threading
-import socket
-from time import sleep
+import time as clock
+from collections import deque
 from sys import maxsize
+from peer_channel import PeerChannel
+
+DEFAULT_IP_LIST = [3001, 3002, 3003]
+DEFAULT_RESOURCE = "global"
+
+# --- Lease Configuration ---
+LEASE_TTL = 10        # Seconds a lease lasts unless its holder renews it
+ACQUIRE_TIMEOUT = 30  # Seconds enter_CS waits for the lock (a lease, or every peer's OK) before raising TimeoutError
+
+class CriticalSection:
+    """This process's Ricart-Agrawala state for one resource."""
+    def __init__(self, state_lock):
+        self.IN_FLAG = False     # True while we want, or hold, the resource
+        self.IN_TIME = maxsize   # Timestamp of our current request
+        self.IN_QUEUE = []       # (address, request time) of requests deferred until we exit
+        self.OK_COUNT = 0        # OKs received for the current request
+        self.users = 0           # Local threads holding or waiting for the resource
+        self.local_lock = threading.Lock() # Lets one local thread at a time run the protocol
+        self.ok_received = threading.Condition(state_lock)
 
 class RicAgra:
-    IN_FLAG = False
-    IN_TIME = maxsize
-    IN_QUEUE = []
-    OK_COUNT = 0
-    port = 0
-
-    def __init__(self,port):
-        ra_deamon = threading.Thread(target=self.ric_agra_deamon,args=[port,],daemon=True)
-        ra_deamon.start()
+    """
+    Ricart-Agrawala mutual exclusion between the processes listening on ip_list.
+
+    Each resource key (a patient uuid, a table name, ...) is an independent
+    critical section with its own REQ/OK/deferred-queue state, so operations
+    on different resources never wait for each other. All keys share one
+    persistent framed channel per peer.
+
+    All protocol state is guarded by one lock; the channel's reader threads
+    signal a condition variable as OKs arrive, so enter_CS wakes up the moment
+    the last OK is in. Each OK names the request it answers, so a late OK for
+    an abandoned request is not counted toward the next one.
+    """
+
+    def __init__(self,port,acquire_timeout=ACQUIRE_TIMEOUT):
         self.port = port
-        
-    def send_ok(self,addr):
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.connect(('localhost',addr[1]))
-        client_socket.sendall('OK'.encode())
-        client_socket.close()
-
-
-    def ric_agra_deamon(self,port=3000):
-        """Starts the server that listens for incoming RPC requests."""
-        
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.bind(('0.0.0.0', port))
-        server_socket.listen(1)
+        self.acquire_timeout = acquire_timeout
+        self.sections = {}       # resource -> CriticalSection, kept only while in use locally
+        self.state_lock = threading.Lock()
+        self.channel = PeerChannel(port, self.handle_message)
+
+    def send_ok(self,addr,request_time,resource):
+        try:
+            self.channel.send(addr[1], f"OK#{request_time}#{resource}")
+        except OSError:
+            pass # The requester is gone; nobody is waiting for this OK
+
+    def handle_message(self,request):
+        """Handles one REQ or OK message from another process."""
+        if request.startswith("REQ"):
+            a = request.split("#", 3)
+            addr = ['localhost',int(a[2])]
+            resource = a[3]
+            with self.state_lock:
+                section = self.sections.get(resource)
+                # Ties on the timestamp go to the lower port, so two requests never defer each other.
+                defer = section is not None and section.IN_FLAG and (section.IN_TIME, self.port) < (float(a[1]), addr[1])
+                if defer:
+                    section.IN_QUEUE.append((addr, a[1]))
+            if not defer:
+                self.send_ok(addr, a[1], resource)
+
+        elif request.startswith("OK"):
+            _, request_time, resource = request.split("#", 2)
+            with self.state_lock:
+                section = self.sections.get(resource)
+                if section is not None and section.IN_FLAG and request_time == str(section.IN_TIME):
+                    section.OK_COUNT+=1
+                    section.ok_received.notify_all()
+
+    def enter_CS(self,time,ip_list=DEFAULT_IP_LIST,resource=DEFAULT_RESOURCE):
+        """
+        Blocks until every other process in ip_list has granted the resource.
+        Raises TimeoutError after acquire_timeout, or OSError if a peer cannot
+        be reached; either way the request is withdrawn as if exit_CS had run.
+        """
+        peers = [ip for ip in ip_list if ip != self.port]
+        with self.state_lock:
+            section = self.sections.get(resource)
+            if section is None:
+                section = self.sections[resource] = CriticalSection(self.state_lock)
+            section.users += 1
+        section.local_lock.acquire()
+
+        with self.state_lock:
+            section.IN_TIME = time
+            section.IN_FLAG = True
+            section.OK_COUNT = 0
+
+        request = f"REQ#"+str(time)+"#"+str(self.port)+"#"+resource
+        try:
+            for ip in peers:
+                self.channel.send(ip, request)
+
+            with section.ok_received:
+                if not section.ok_received.wait_for(lambda: section.OK_COUNT >= len(peers), self.acquire_timeout):
+                    raise TimeoutError(f"No lock on '{resource}' after {self.acquire_timeout}s: "
+                                       f"{section.OK_COUNT}/{len(peers)} peers granted it")
+                section.OK_COUNT = 0
+        except BaseException:
+            # Give up our place: answer deferred requests and let the next local thread try.
+            self.exit_CS(resource)
+            raise
+
+    def exit_CS(self,resource=DEFAULT_RESOURCE):
+        with self.state_lock:
+            section = self.sections[resource]
+            section.IN_FLAG=False
+            section.IN_TIME = maxsize
+            deferred, section.IN_QUEUE = section.IN_QUEUE, []
+            section.users -= 1
+            if section.users == 0:
+                del self.sections[resource]
+        section.local_lock.release()
+        for addr, request_time in deferred:
+            self.send_ok(addr, request_time, resource)
+
+
+class LeaseLock:
+    """
+    A leader-based lock manager with the same enter_CS / exit_CS API as RicAgra.
+
+    The lowest port in ip_list is the leader and keeps the lease table; every
+    other process sends it ACQ and receives a GRANT, so an acquire costs one
+    round trip however many processes there are. Leases expire after
+    LEASE_TTL unless renewed, which a background thread does while a lease is
+    held, so a crashed holder frees its resources on its own.
+
+    Every grant carries a fencing token that is larger than every token issued
+    before it, even across leader restarts. enter_CS returns it; storage that
+    remembers the highest token it has seen can reject writes from a holder
+    whose lease expired while it was paused.
+    """
+
+    def __init__(self,port,ttl=LEASE_TTL,acquire_timeout=ACQUIRE_TIMEOUT):
+        self.port = port
+        self.ttl = ttl
+        self.acquire_timeout = acquire_timeout
+        self.state_lock = threading.Lock()
+        # Client side
+        self.request_ids = itertools.count(1)
+        self.pending = {}        # request id -> [Event, token]
+        self.held = {}           # resource -> (leader, request id, token)
+        # Leader side
+        self.leases = {}         # resource -> [holder port, request id, token, expires]
+        self.waiting = {}        # resource -> deque of (port, request id)
+        self.next_token = int(clock.time() * 1000) # Tokens keep growing across leader restarts
+        self.lease_changed = threading.Condition(self.state_lock)
+        self.channel = PeerChannel(port, self.handle_message)
+        threading.Thread(target=self.renew_daemon, daemon=True).start()
+        threading.Thread(target=self.expiry_daemon, daemon=True).start()
+
+    def deliver(self,port,message):
+        """Sends a message, handling it in place when this process is the receiver."""
+        if port == self.port:
+            self.handle_message(message)
+        else:
+            self.channel.send(port, message)
+
+    def handle_message(self,request):
+        kind, *fields = request.split("#", 3) # The resource key comes last and may itself contain '#'
+        if kind == "GRANT":
+            request_id, token = int(fields[0]), int(fields[1])
+            with self.state_lock:
+                waiter = self.pending.pop(request_id, None)
+            if waiter is not None:
+                waiter[1] = token
+                waiter[0].set()
+            return
+        port, request_id, resource = int(fields[0]), int(fields[1]), fields[2]
+        with self.state_lock:
+            if kind == "ACQ":
+                self.waiting.setdefault(resource, deque()).append((port, request_id))
+                grants = self.grant_next(resource)
+            elif kind == "RENEW":
+                lease = self.leases.get(resource)
+                if lease is not None and lease[:2] == [port, request_id]:
+                    lease[3] = clock.time() + self.ttl
+                grants = []
+            else: # REL, or CANCEL of a request that timed out
+                queue = self.waiting.get(resource)
+                if queue and (port, request_id) in queue:
+                    queue.remove((port, request_id))
+                lease = self.leases.get(resource)
+                if lease is not None and lease[:2] == [port, request_id]:
+                    del self.leases[resource]
+                grants = self.grant_next(resource)
+        for grant_port, grant in grants:
+            self.deliver(grant_port, grant)
+
+    def grant_next(self,resource):
+        """Hands a free or expired lease to the next waiter. Caller holds state_lock; returns the GRANT to send."""
+        lease = self.leases.get(resource)
+        queue = self.waiting.get(resource)
+        if lease is not None and lease[3] > clock.time():
+            return []
+        self.leases.pop(resource, None)
+        if not queue:
+            self.waiting.pop(resource, None)
+            return []
+        port, request_id = queue.popleft()
+        self.next_token += 1
+        self.leases[resource] = [port, request_id, self.next_token, clock.time() + self.ttl]
+        self.lease_changed.notify_all()
+        return [(port, f"GRANT#{request_id}#{self.next_token}")]
+
+    def expiry_daemon(self):
+        """On the leader, takes back leases whose holders stopped renewing them."""
         while True:
-            # Accept client connection
-            conn,addr = server_socket.accept()
-            
-            addr = conn.getsockname()
-            
-            data = conn.recv(1024)  # 1024 bytes at a time
-            conn.close()
-
-        
-
-            if data:
-                # Decode the data into a string and process it
-                request = data.decode()
-
-                
-
-                if request.startswith("REQ"):
-                    a = request.split("#")
-                    addr = ['localhost',int(a[2])]
-                    
-                    # Extract numbers from the request
-                    if(self.IN_FLAG):
-                        if(float(a[1])<self.IN_TIME):
-                            self.send_ok(addr)
-                        else:
-                            self.IN_QUEUE.append(addr)
-                            
-                    else:
-                        
-                        self.send_ok(addr)
-
-                    # Send the result back to the client
-
-                if request.startswith("OK"):
-                    self.OK_COUNT+=1
-
-    def enter_CS(self,time,ip_list=[3001,3002,3003]):
-        """Starts the server that listens for incoming RPC requests."""
-        """Call the RPC server to add two numbers."""
-        # Send a request to the server to add numbers
-         
-        self.IN_TIME=time
-        self.IN_FLAG = True
-
-        n = len(ip_list)
-
-        for ip in ip_list:
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            if(ip!=self.port):
-                client_socket.connect(('localhost', ip))
-
-                request = f"REQ#"+str(self.IN_TIME)+"#"+str(self.port)
-                client_socket.sendall(request.encode())
-
-                # Close the connection
-                client_socket.close()
-
-        while(self.OK_COUNT!=len(ip_list)-1):
-            sleep(2)
-            print(self.OK_COUNT)
-        self.OK_COUNT=0
-            
-    
-        
-
-    def exit_CS(self):
-        self.IN_FLAG=False
-        for addr in self.IN_QUEUE:
-            self.send_ok(addr)
-        self.IN_QUEUE=[]
-        
\ No newline at end of file
+            with self.state_lock:
+                now = clock.time()
+                expiries = [lease[3] for lease in self.leases.values()]
+                self.lease_changed.wait(max(0, min(expiries) - now) if expiries else None)
+                grants = []
+                for resource in [r for r, lease in self.leases.items() if lease[3] <= clock.time()]:
+                    print(f"[{self.port}] Lease on '{resource}' expired; holder {self.leases[resource][0]} stopped renewing")
+                    grants += self.grant_next(resource)
+            for grant_port, grant in grants:
+                self.deliver(grant_port, grant)
+
+    def renew_daemon(self):
+        while True:
+            clock.sleep(self.ttl / 3)
+            with self.state_lock:
+                held = list(self.held.items())
+            for resource, (leader, request_id, _) in held:
+                try:
+                    self.deliver(leader, f"RENEW#{self.port}#{request_id}#{resource}")
+                except OSError as e:
+                    print(f"[{self.port}] Could not renew lease on '{resource}': {e}")
+
+    def enter_CS(self,time=None,ip_list=DEFAULT_IP_LIST,resource=DEFAULT_RESOURCE):
+        """Blocks until this process holds the lease on resource, and returns its fencing token."""
+        leader = min(ip_list)
+        request_id = next(self.request_ids)
+        waiter = [threading.Event(), None]
+        with self.state_lock:
+            self.pending[request_id] = waiter
+        self.deliver(leader, f"ACQ#{self.port}#{request_id}#{resource}")
+        if not waiter[0].wait(self.acquire_timeout):
+            with self.state_lock:
+                self.pending.pop(request_id, None)
+            self.deliver(leader, f"CANCEL#{self.port}#{request_id}#{resource}")
+            raise TimeoutError(f"No lease on '{resource}' from leader {leader} within {self.acquire_timeout}s")
+        with self.state_lock:
+            self.held[resource] = (leader, request_id, waiter[1])
+        return waiter[1]
+
+    def exit_CS(self,resource=DEFAULT_RESOURCE):
+        with self.state_lock:
+            leader, request_id, _ = self.held.pop(resource)
+        self.deliver(leader, f"REL#{self.port}#{request_id}#{resource}")
+
+    def token(self,resource=DEFAULT_RESOURCE):
+        """The fencing token of the lease this process holds on resource."""
+        with self.state_lock:
+            return self.held[resource][2]
+
+
+# Lock managers a deployment can choose between; both are created with the daemon port.
+LOCK_BACKENDS = {
+    "ricart_agrawala": RicAgra,
+    "lease": LeaseLock,
+}
@@ -0,0 +1,257 @@
+import hashlib
+import json
+import threading
+import time
+
+# --- Default Configuration ---
+DEFAULT_DEPTH = 3            # Hex digits of the key hash per leaf: 16 ** 3 = 4096 leaves per table
+DEFAULT_INTERVAL = 60        # Seconds between resync rounds with each peer
+DEFAULT_TREE_MAX_AGE = 10    # Seconds a built tree is served to peers before it is rebuilt
+DEFAULT_PREFIX_BATCH = 256   # Tree nodes or leaves compared per RPC
+DEFAULT_ROW_BATCH = 200      # Divergent rows pulled per RPC
+
+HEX_DIGITS = "0123456789abcdef"
+EMPTY_DIGEST = "0" * 40
+
+
+def row_digest(row):
+    """A stable digest of one row's values, identical on every replica with the same schema."""
+    return hashlib.sha1(json.dumps(list(row), separators=(",", ":")).encode()).hexdigest()
+
+def key_bucket(key, depth):
+    """The leaf a primary key falls in: the first depth hex digits of its hash, whatever the key looks like."""
+    return hashlib.sha1(str(key).encode()).hexdigest()[:depth]
+
+def prefix_upper_bound(prefix):
+    """The smallest key greater than every key that starts with prefix (prefix is never empty)."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class MerkleTree:
+    """
+    A 16-ary Merkle tree over one table, keyed by the leading hex digits of a
+    hash of the primary key (key_bucket). Hashing spreads any key evenly over
+    the leaves: uuids as well as usernames, whatever their letters or case.
+
+    A leaf's digest is the XOR of its row digests, so the tree is built in one
+    unordered pass over the table; an inner node hashes its 16 children. When
+    row_filter is given, row_filter(columns) returns a predicate and only the
+    rows it accepts are part of the tree.
+    """
+    def __init__(self, cursor, table, key_column, depth=DEFAULT_DEPTH, row_filter=None):
+        self.depth = depth
+        self.built = time.time()
+        leaves = {}
+        cursor.execute(f"SELECT * FROM {table}")
+        columns = [desc[0] for desc in cursor.description]
+        key_index = columns.index(key_column)
+        keep = row_filter(columns) if row_filter else None
+        for row in cursor:
+            if keep is not None and not keep(row):
+                continue
+            prefix = key_bucket(row[key_index], depth)
+            leaves[prefix] = leaves.get(prefix, 0) ^ int(row_digest(row), 16)
+        self.digests = {prefix: f"{value:040x}" for prefix, value in leaves.items()}
+        for level in range(depth - 1, -1, -1):
+            parents = {prefix[:level] for prefix in self.digests if len(prefix) == level + 1}
+            for parent in parents:
+                children = "".join(self.digests.get(parent + digit, EMPTY_DIGEST) for digit in HEX_DIGITS)
+                self.digests[parent] = hashlib.sha1(children.encode()).hexdigest()
+
+    def digest(self, prefix):
+        return self.digests.get(prefix, EMPTY_DIGEST)
+
+
+class AntiEntropy:
+    """
+    Periodically compares this node's tables with each peer's and pulls the rows
+    it is missing or holds an older copy of.
+
+    Peers walk their Merkle trees top-down and only descend into subtrees whose
+    digests differ; at the leaves they swap (key, row digest) lists and then
+    fetch just the divergent rows. Repair traffic therefore follows the size of
+    the difference, not the size of the table. Every node pulls from every peer,
+    so rows a peer is missing reach it on the peer's own round.
+
+    When the tables carry a version_column, the higher version of a row wins.
+
+    On a sharded cluster each pair of nodes only compares the rows both of them
+    hold: shard_columns names the column each table is placed by, and
+    shares(shard_key, peer) tells whether this node and peer both own a key.
+    Requests then carry this node's address, so the peer builds the same view.
+    """
+    def __init__(self, db_pool, tables, peers, send, depth=DEFAULT_DEPTH, interval=DEFAULT_INTERVAL,
+                 tree_max_age=DEFAULT_TREE_MAX_AGE, prefix_batch=DEFAULT_PREFIX_BATCH, row_batch=DEFAULT_ROW_BATCH,
+                 version_column=None, node=None, shard_columns=None, shares=None):
+        self.db_pool = db_pool
+        self.tables = tables # {table: primary key column}, synced in this order
+        self.version_column = version_column
+        self.node = node     # This node's (host, port), sent as the scope of sharded requests
+        self.shard_columns = shard_columns
+        self.shares = shares
+        self.peers = list(peers)
+        self.send = send # send(peer, message) -> response dict
+        self.depth = depth
+        self.interval = interval
+        self.tree_max_age = tree_max_age
+        self.prefix_batch = prefix_batch
+        self.row_batch = row_batch
+        self.trees = {}
+        self.lock = threading.Lock()
+
+    def set_peers(self, peers):
+        """Replaces the peers that later rounds sync with."""
+        self.peers = list(peers)
+
+    def start(self):
+        syncer = threading.Thread(target=self.sync_daemon, daemon=True)
+        syncer.start()
+
+    # --- Serving peers ---
+    def scope_filter(self, table, scope):
+        """Returns a row_filter keeping the rows of table this node shares with scope, or None to keep them all."""
+        if scope is None or self.shares is None:
+            return None
+        def row_filter(columns):
+            shard_index = columns.index(self.shard_columns[table])
+            return lambda row: self.shares(row[shard_index], scope)
+        return row_filter
+
+    def request_scope(self, data):
+        scope = data.get("scope")
+        return tuple(scope) if scope else None
+
+    def tree(self, table, max_age=None, scope=None):
+        """Returns the table's tree, as shared with scope, rebuilding it when it is older than max_age seconds."""
+        max_age = self.tree_max_age if max_age is None else max_age
+        with self.lock:
+            tree = self.trees.get((table, scope))
+            if tree is None or time.time() - tree.built > max_age:
+                cursor = self.db_pool.connection().cursor()
+                try:
+                    tree = MerkleTree(cursor, table, self.tables[table], self.depth, self.scope_filter(table, scope))
+                finally:
+                    cursor.close()
+                self.trees[(table, scope)] = tree
+            return tree
+
+    def handle_digests(self, cursor, data):
+        """Returns the digests of the requested tree nodes."""
+        table = data.get("table")
+        if table not in self.tables:
+            return {"status": "error", "code": 400, "error": f"Table '{table}' is not synced"}
+        tree = self.tree(table, scope=self.request_scope(data))
+        return {"status": "success", "depth": tree.depth,
+                "digests": {prefix: tree.digest(prefix) for prefix in data.get("prefixes") or []}}
+
+    def handle_keys(self, cursor, data):
+        """Returns {key: [version, row digest]} for every row under the requested leaves."""
+        table = data.get("table")
+        if table not in self.tables:
+            return {"status": "error", "code": 400, "error": f"Table '{table}' is not synced"}
+        return {"status": "success", "keys": self.leaf_keys(cursor, table, data.get("prefixes") or [], self.request_scope(data))}
+
+    def handle_rows(self, cursor, data):
+        """Returns the full rows for the requested keys."""
+        table = data.get("table")
+        if table not in self.tables:
+            return {"status": "error", "code": 400, "error": f"Table '{table}' is not synced"}
+        keys = data.get("keys") or []
+        placeholders = ",".join("?" * len(keys))
+        cursor.execute(f"SELECT * FROM {table} WHERE {self.tables[table]} IN ({placeholders})", keys)
+        columns = [desc[0] for desc in cursor.description]
+        return {"status": "success", "columns": columns, "rows": [list(row) for row in cursor.fetchall()]}
+
+    def leaf_keys(self, cursor, table, prefixes, scope=None):
+        """
+        Returns {key: [version, row digest]} for the rows under the given leaves.
+        Leaves are hash buckets, not key ranges, so this is one pass over the
+        table however many leaves are asked for.
+        """
+        key_column = self.tables[table]
+        row_filter = self.scope_filter(table, scope)
+        wanted = set(prefixes)
+        keys = {}
+        cursor.execute(f"SELECT * FROM {table}")
+        columns = [desc[0] for desc in cursor.description]
+        key_index = columns.index(key_column)
+        version_index = columns.index(self.version_column) if self.version_column else None
+        keep = row_filter(columns) if row_filter else None
+        for row in cursor:
+            if key_bucket(row[key_index], self.depth) not in wanted:
+                continue
+            if keep is not None and not keep(row):
+                continue
+            keys[row[key_index]] = [row[version_index] if version_index is not None else 0, row_digest(row)]
+        return keys
+
+    # --- Pulling from peers ---
+    def sync_daemon(self):
+        while True:
+            time.sleep(self.interval)
+            for peer in self.peers:
+                try:
+                    self.sync_peer(peer)
+                except Exception as e:
+                    print(f"[WARNING] Anti-entropy with {peer[0]}:{peer[1]} failed: {e}")
+
+    def call(self, peer, action, data):
+        if self.shares is not None:
+            data = dict(data, scope=list(self.node))
+        response = self.send(peer, {"action": action, "data": data})
+        if not response or response.get("status") != "success":
+            raise ConnectionError((response or {}).get("message") or (response or {}).get("error") or "no response")
+        return response
+
+    def sync_peer(self, peer):
+        """Runs one resync round against a peer. Returns the number of rows repaired per table."""
+        repaired = {}
+        for table in self.tables:
+            local = self.tree(table, max_age=0, scope=peer if self.shares is not None else None)
+            divergent = self.divergent_leaves(peer, table, local)
+            repaired[table] = self.repair_leaves(peer, table, divergent) if divergent else 0
+            if repaired[table]:
+                print(f"[*] Anti-entropy: pulled {repaired[table]} rows of '{table}' from {peer[0]}:{peer[1]} "
+                      f"({len(divergent)} of {16 ** local.depth} leaves differed)")
+        return repaired
+
+    def divergent_leaves(self, peer, table, local):
+        """Walks both trees level by level, descending only where the digests differ."""
+        prefixes = [""]
+        for level in range(local.depth + 1):
+            differing = []
+            for start in range(0, len(prefixes), self.prefix_batch):
+                batch = prefixes[start:start + self.prefix_batch]
+                response = self.call(peer, "merkle_digests", {"table": table, "prefixes": batch})
+                if response.get("depth") != local.depth:
+                    raise ValueError(f"peer uses tree depth {response.get('depth')}, this node uses {local.depth}")
+                differing += [prefix for prefix in batch if response["digests"].get(prefix) != local.digest(prefix)]
+            if level == local.depth or not differing:
+                return differing
+            prefixes = [prefix + digit for prefix in differing for digit in HEX_DIGITS]
+        return []
+
+    def repair_leaves(self, peer, table, leaves):
+        """Compares the rows under the differing leaves and pulls the ones this node should take."""
+        conn = self.db_pool.connection()
+        cursor = conn.cursor()
+        repaired = 0
+        try:
+            for start in range(0, len(leaves), self.prefix_batch):
+                batch = leaves[start:start + self.prefix_batch]
+                remote = self.call(peer, "merkle_keys", {"table": table, "prefixes": batch})["keys"]
+                local = self.leaf_keys(cursor, table, batch, peer if self.shares is not None else None)
+                # The newer version wins; between equal versions the larger digest does,
+                # so every replica settles on the same copy.
+                wanted = [key for key, version in remote.items() if key not in local or version > local[key]]
+                for offset in range(0, len(wanted), self.row_batch):
+                    response = self.call(peer, "merkle_rows", {"table": table, "keys": wanted[offset:offset + self.row_batch]})
+                    columns = response["columns"]
+                    with conn:
+                        cursor.executemany(
+                            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                            response["rows"])
+                    repaired += len(response["rows"])
+        finally:
+            cursor.close()
+        return repaired
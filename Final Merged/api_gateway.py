@@ -1,25 +1,40 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 import requests
-from itertools import cycle
+import sys
+import time
+from load_balancer import (
+    balancer, join_cluster, forwardable_headers, node_session, GATEWAY_HOST, GATEWAY_PORT,
+    STREAM_CHUNK_SIZE, UPSTREAM_TIMEOUT, RETRY_METHODS, NODE_FAILURE_STATUSES,
+)
 
 # --- Configuration ---
-# The addresses of our Application Node instances.
-# In a real-world scenario (e.g., using Docker or Kubernetes),
-# these would be service names.
-APP_NODE_URLS = [
-    "http://127.0.0.1:6001",
-    "http://127.0.0.1:6002",
-    "http://127.0.0.1:6003",
-]
-
-# --- Initialize Flask App and Load Balancer ---
+STREAM_MODE = True           # Relay bodies chunk by chunk instead of buffering them
+
+# --- Initialize Flask App ---
 app = Flask(__name__)
 CORS(app)
 
-# Use itertools.cycle for a simple and effective round-robin load balancer.
-# This will cycle through the APP_NODE_URLS list indefinitely.
-app_node_cycler = cycle(APP_NODE_URLS)
+class RequestBodyStream:
+    """Iterates the client request body in chunks while advertising its known length upstream."""
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        while True:
+            chunk = self.stream.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+def relay_body(response):
+    """Yields the upstream body chunk by chunk without buffering it."""
+    for chunk in response.raw.stream(STREAM_CHUNK_SIZE, decode_content=False):
+        yield chunk
 
 # --- Generic Proxy/Forwarding Route ---
 @app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
@@ -28,40 +43,91 @@ def proxy_request(path):
     This is the core of the API Gateway. It captures all incoming requests
     and forwards them to one of the backend Application Nodes.
     """
-    # 1. Select the next Application Node from our cycle.
-    target_node_url = next(app_node_cycler)
-    
+    # 1. Select the least-loaded healthy Application Node. Idempotent requests
+    # without a body are retried once on another node if the first one cannot be reached.
+    attempts = 2 if request.method in RETRY_METHODS and not request.content_length else 1
+    tried = []
+    for _ in range(attempts):
+        backend = balancer.acquire(exclude=tried)
+        if backend is None:
+            break
+        tried.append(backend.url)
+        result = forward_to(backend, path)
+        if result is not None:
+            return result
+
+    return jsonify({"error": "Service unavailable"}), 503
+
+def forward_to(backend, path):
+    """Forwards the current request to one backend. Returns None if the node could not be reached."""
+    target_node_url = backend.url
+    session = node_session(target_node_url)
+
     # Construct the full URL for the target service.
     url = f"{target_node_url}/{path}"
-    
+    if request.query_string:
+        url = f"{url}?{request.query_string.decode()}"
+
     print(f"API Gateway forwarding request for '{path}' to {target_node_url}")
 
+    started = time.time()
     try:
-        # 2. Forward the request.
-        # We use requests.request to dynamically handle any HTTP method.
-        # We also pass along the headers, form data, and JSON data.
-        response = requests.request(
+        # 2. Forward the request over the node's pooled keep-alive session.
+        # In streaming mode the request body is read from the client socket as it
+        # is sent upstream, and the response body is not downloaded up front.
+        if STREAM_MODE and request.content_length:
+            body = RequestBodyStream(request.stream, request.content_length)
+        else:
+            body = request.get_data()
+        response = session.request(
             method=request.method,
             url=url,
-            headers={key: value for (key, value) in request.headers if key != 'Host'},
-            data=request.get_data(),
+            headers=dict(forwardable_headers(request.headers)),
+            data=body,
             cookies=request.cookies,
             allow_redirects=False,
-            timeout=5 # Add a timeout for resilience
+            stream=STREAM_MODE,
+            timeout=UPSTREAM_TIMEOUT # Add a timeout for resilience
         )
-
-        # 3. Return the response from the Application Node back to the original client.
-        # We create a response object with the content, status code, and headers
-        # from the backend service's response.
-        headers = [(name, value) for (name, value) in response.raw.headers.items()]
-        return response.content, response.status_code, headers
-
     except requests.exceptions.RequestException as e:
         print(f"Error forwarding request to {target_node_url}: {e}")
-        return jsonify({"error": "Service unavailable"}), 503
+        balancer.record_failure(backend)
+        balancer.release(backend)
+        return None
+
+    if response.status_code in NODE_FAILURE_STATUSES:
+        balancer.record_failure(backend)
+    else:
+        balancer.record_success(backend, time.time() - started)
+
+    # 3. Return the response from the Application Node back to the original client.
+    # We create a response object with the content, status code, and headers
+    # from the backend service's response.
+    headers = forwardable_headers(response.raw.headers)
+    if STREAM_MODE:
+        relayed = Response(relay_body(response), status=response.status_code, headers=headers)
+        # Return the connection to the pool and free the slot once the client has the body.
+        relayed.call_on_close(response.close)
+        relayed.call_on_close(lambda: balancer.release(backend))
+        return relayed
+    balancer.release(backend)
+    return response.content, response.status_code, headers
 
+def main(host=GATEWAY_HOST, port=GATEWAY_PORT):
+    join_cluster(port)
+    print(f"API Gateway is running on http://{host}:{port}")
+    # The reloader would run this a second time in a child process, which
+    # could not bind the gossip port again.
+    app.run(host=host, port=port, debug=True, use_reloader=False)
 
 if __name__ == '__main__':
-    # The gateway runs on port 5000, which is what the frontend expects.
-    print("API Gateway is running on http://127.0.0.1:5000")
-    app.run(port=5000, debug=True)
\ No newline at end of file
+    # Usage: python api_gateway.py [flask|asyncio]
+    engine = sys.argv[1] if len(sys.argv) > 1 else "flask"
+    if engine == "asyncio":
+        import async_gateway
+        async_gateway.main()
+    elif engine == "flask":
+        main()
+    else:
+        print("Usage: python api_gateway.py [flask|asyncio]")
+        sys.exit(1)
@@ -1,27 +1,64 @@
 import sys
+import hashlib
+import random
+import threading
 import xmlrpc.client
+from rpc_pool import NodeRPCClient
+from membership import Membership, load_cluster_config
+from sharding import HashRing
+from scatter_gather import ScatterGather
+from cache import LocalCache, TwoTierCache
 from itertools import cycle
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import redis # Import the redis library
-import json # Import the json library for serialization
 
 # --- Configuration ---
-DATA_NODES = [
-    ('127.0.0.1', 7001),
-    ('127.0.0.1', 7002),
-    ('127.0.0.1', 7003),
-]
+# Data nodes are listed in cluster.json. Requests about one patient go to the
+# replicas that own it on the hash ring; other requests rotate over the data
+# nodes that membership reports as up.
+DATA_NODES = [(node["host"], node["port"]) for node in load_cluster_config()["data_node"]]
 data_node_cycler = cycle(DATA_NODES)
+ring = HashRing(DATA_NODES)
+alive_data_nodes = set(DATA_NODES)
+membership = None # This node's view of the cluster, created in __main__
+
+# --- RPC Connection Configuration ---
+RPC_PROTOCOL = "auto"      # "xmlrpc", "binary", or "auto" (binary wherever the Data Node offers it)
+RPC_POOL_SIZE = 8          # Max keep-alive XML-RPC connections held open to each Data Node
+RPC_IDLE_TIMEOUT = 10      # Seconds before an unused connection is closed (data nodes drop them after 15)
+RETRY_ACTIONS = {'get_data', 'get_records_by_uuid'}  # Reads that may be retried on another replica
+rpc_clients = {}          # (host, port) -> NodeRPCClient, created on first use
+rpc_clients_lock = threading.Lock()
 
 # --- REDIS CACHE Configuration ---
 REDIS_HOST = 'localhost'
 REDIS_PORT = 6379
-CACHE_TTL_SECONDS = 300 # Time-To-Live for cache entries: 5 minutes
+CACHE_TTL_SECONDS = 300 # Seconds until a cached page is due for a refresh: 5 minutes
+CACHE_STALE_SECONDS = 300 # Seconds past that a records or listing page is still served while it is refreshed
+CACHE_XFETCH_BETA = 1.0 # Refreshes start early at random, sooner for slower loads; 0 waits for expiry
+LOCAL_CACHE_MAX_BYTES = 64 * 1024 * 1024 # In-process copies of cached pages, bounded by their JSON size
+LOCAL_CACHE_TTL = 30    # Seconds an in-process copy is trusted; invalidations normally drop it sooner
+CACHE_LOAD_LOCK_MS = 3000 # Misses of one page wait for whichever App Node is loading it; 0 coalesces only within this node
+
+# --- Pagination Configuration ---
+DEFAULT_PAGE_SIZE = 50  # Records returned when the client does not pass ?limit=
+MAX_PAGE_SIZE = 500
+NEXT_PAGE_HEADER = 'X-Next-Before-Timestamp'
+NEXT_PAGE_ID_HEADER = 'X-Next-Before-Record-Id'  # Breaks ties between records with the same timestamp
+
+# --- Patient Listing Configuration ---
+DEFAULT_PATIENT_PAGE = 100  # Patients returned when the client does not pass ?limit=
+MAX_PATIENT_PAGE = 500
+NEXT_OFFSET_HEADER = 'X-Next-Offset'
+PATIENT_PAGES_KEY = 'patient_pages' # Redis hash of cached listing pages, dropped whenever an account is added
+
+# --- Batch Import Configuration ---
+BATCH_CHUNK_SIZE = 500  # Records sent to a Data Node per add_records_batch call (one quorum round each)
 
 # --- Initialize Flask App and Redis ---
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=[NEXT_PAGE_HEADER, NEXT_PAGE_ID_HEADER, NEXT_OFFSET_HEADER])
 
 # Establish connection to Redis
 try:
@@ -33,34 +70,129 @@ except redis.exceptions.ConnectionError as e:
     print("[WARNING] Caching will be disabled.")
     redis_client = None
 
+# Pages are cached in-process in front of Redis; deletes reach every App Node over Redis pub/sub.
+cache = TwoTierCache(redis_client, LocalCache(LOCAL_CACHE_MAX_BYTES, LOCAL_CACHE_TTL), CACHE_TTL_SECONDS,
+                     load_lock_ttl_ms=CACHE_LOAD_LOCK_MS, stale_ttl=CACHE_STALE_SECONDS,
+                     xfetch_beta=CACHE_XFETCH_BETA) if redis_client else None
+
+
+# --- Cluster Membership ---
+def on_membership_change(view):
+    """Rotates over the data nodes that are up; if none are, keeps trying every listed one."""
+    global data_node_cycler, ring, alive_data_nodes
+    nodes = [(node["host"], node["port"]) for node in view.alive("data_node") or view.members("data_node")]
+    data_node_cycler = cycle(nodes)
+    alive_data_nodes = set(nodes)
+    members = [(node["host"], node["port"]) for node in view.members("data_node")]
+    if set(members) != set(ring.nodes):
+        ring = HashRing(members)
+
+def route(shard_key):
+    """The data nodes to try for shard_key: its replicas that are up, in random order, or the next node in rotation."""
+    if shard_key is None:
+        return [next(data_node_cycler)]
+    owners = ring.owners(shard_key)
+    candidates = [node for node in owners if node in alive_data_nodes] or owners
+    return random.sample(candidates, len(candidates))
 
-# --- XML-RPC Client Function (No changes needed) ---
-def send_rpc_to_data_node(rpc_message):
-    """Sends a message to a Data Node using XML-RPC."""
-    node_host, node_port = next(data_node_cycler)
+# --- RPC Client Function ---
+def rpc_client(node):
+    with rpc_clients_lock:
+        client = rpc_clients.get(node)
+        if client is None:
+            client = rpc_clients[node] = NodeRPCClient(node[0], node[1], RPC_PROTOCOL, RPC_POOL_SIZE, RPC_IDLE_TIMEOUT)
+        return client
+
+def send_rpc_to_data_node(rpc_message, shard_key=None):
+    """
+    Sends a message to a Data Node over a persistent connection (binary RPC or
+    pooled XML-RPC). With a shard_key (a patient uuid, or a username for logins)
+    it goes to one of the replicas that own it; reads move on to the next replica
+    if one is down.
+    """
     action = rpc_message['action']
     data = rpc_message['data']
     
-    print(f"[*] AppNode-{app.port}: Forwarding action '{action}' to DataNode http://{node_host}:{node_port}")
-    
-    try:
-        proxy = xmlrpc.client.ServerProxy(f"http://{node_host}:{node_port}/", allow_none=True)
-        response_json = proxy.dispatch_rpc(action, data)
-        print(f"[*] AppNode-{app.port}: Received response from DataNode: {response_json}")
-        return response_json
-        
-    except (ConnectionRefusedError, xmlrpc.client.ProtocolError) as e:
-        error_msg = f"Data service at {node_host}:{node_port} is unavailable."
-        print(f"[ERROR] {error_msg} - {e}")
-        return {"status": "error", "code": 503, "error": error_msg}
-        
-    except Exception as e:
-        error_msg = f"An unexpected RPC error occurred: {e}"
-        print(f"[ERROR] {error_msg}")
-        return {"status": "error", "code": 500, "error": error_msg}
+    for node_host, node_port in route(shard_key):
+        print(f"[*] AppNode-{app.port}: Forwarding action '{action}' to DataNode http://{node_host}:{node_port}")
+        try:
+            response_json = rpc_client((node_host, node_port)).call(action, data)
+            print(f"[*] AppNode-{app.port}: Received response from DataNode: {response_json}")
+            return response_json
+
+        except (ConnectionError, xmlrpc.client.ProtocolError) as e:
+            error_msg = f"Data service at {node_host}:{node_port} is unavailable."
+            print(f"[ERROR] {error_msg} - {e}")
+            if action not in RETRY_ACTIONS:
+                break
+
+        except Exception as e:
+            error_msg = f"An unexpected RPC error occurred: {e}"
+            print(f"[ERROR] {error_msg}")
+            return {"status": "error", "code": 500, "error": error_msg}
+
+    return {"status": "error", "code": 503, "error": error_msg}
+
+# --- Scatter-Gather Patient Listing ---
+def fetch_patients(node, request_data):
+    response = rpc_client(node).call("list_patients", request_data)
+    if response.get("status") != "success":
+        raise ConnectionError(response.get("error") or response.get("message"))
+    return response["patients"]
+
+patient_listing = ScatterGather(
+    fetch_patients,
+    sort_key=lambda row: (row['first_name'], row['last_name'], row['uuid']),
+    identity=lambda row: row['uuid'],
+    version=lambda row: row['version'],
+)
+
+# --- Pagination Helpers ---
+def read_page_args():
+    """Reads the page size and keyset cursor (?limit=&before_timestamp=&before_record_id=) from the query string."""
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    before = {"before_timestamp": request.args.get('before_timestamp', type=float),
+              "before_record_id": request.args.get('before_record_id')}
+    return limit, before
+
+def page_cache_field(limit, before):
+    """Each page is a field of its key's Redis hash, so deleting the key drops every page at once."""
+    if before['before_timestamp'] is None:
+        return f"first:{limit}"
+    return f"{before['before_timestamp']}:{before['before_record_id'] or ''}:{limit}"
+
+def credentials_digest(auth):
+    """Identifies a username and password pair without the password itself ending up in Redis."""
+    return hashlib.sha256(f"{auth.username}\0{auth.password}".encode()).hexdigest()
+
+def page_from(rpc_response):
+    """The cacheable page of a successful read: its data and the cursor of the page after it."""
+    return {"data": rpc_response.get('data'), "next_before_timestamp": rpc_response.get('next_before_timestamp'),
+            "next_before_record_id": rpc_response.get('next_before_record_id')}
+
+def page_response(page, status_code=200):
+    response = jsonify(page['data'])
+    if page.get('next_before_timestamp') is not None:
+        response.headers[NEXT_PAGE_HEADER] = repr(page['next_before_timestamp'])
+        if page.get('next_before_record_id') is not None:
+            response.headers[NEXT_PAGE_ID_HEADER] = page['next_before_record_id']
+    return response, status_code
 
 # --- API Endpoints (Updated with Caching Logic) ---
 
+@app.route('/health', methods=['GET'])
+def health():
+    """Liveness probe used by the API Gateway's load balancer."""
+    return jsonify({"status": "ok"}), 200
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hits and misses of this App Node's in-process and Redis cache tiers."""
+    if not cache:
+        return jsonify({"error": "Caching is disabled"}), 503
+    return jsonify(cache.stats()), 200
+
 @app.route('/add_account', methods=['POST'])
 def add_account():
     print(f"\n--- AppNode-{app.port}: Received request for /add_account ---")
@@ -70,13 +202,14 @@ def add_account():
     payload = request.get_json()
     print(f"[*] AppNode-{app.port}: Payload: {payload}")
     rpc_payload = {"action": "add_account", "data": payload}
-    rpc_response = send_rpc_to_data_node(rpc_payload)
+    username = payload.get('username')
+    rpc_response = send_rpc_to_data_node(rpc_payload, username if isinstance(username, str) else None)
     
     # WRITE-THROUGH: Invalidate cache after successful DB write
-    if redis_client and rpc_response.get('status') == 'success':
-        # Adding a new account invalidates the list of all patients
-        print("[*] Cache Invalidation: Deleting 'all_patients' key.")
-        redis_client.delete("all_patients")
+    if cache and rpc_response.get('status') == 'success':
+        # Adding a new account invalidates every page of the patient listing
+        print(f"[*] Cache Invalidation: Deleting '{PATIENT_PAGES_KEY}' key.")
+        cache.delete(PATIENT_PAGES_KEY)
 
     status_code = rpc_response.get('code', 500)
     return jsonify(rpc_response), status_code
@@ -87,30 +220,37 @@ def get_data(username):
     auth = request.authorization
     if not auth or not auth.username or not auth.password:
         return jsonify({"error": "Authentication required"}), 401
+    limit, before = read_page_args()
     
-    # CACHE LOGIC: Check cache first for this user's data
+    # CACHE LOGIC: Check cache first for this page of the user's data
+    # Pages are cached per username and password: only the data node checks the
+    # password, so a hit must not be reachable with any other one.
     cache_key = f"user_data:{auth.username}"
-    if redis_client:
-        cached_data = redis_client.get(cache_key)
-        if cached_data:
-            print(f"[*] Cache Hit for key: '{cache_key}'")
-            return jsonify(json.loads(cached_data)), 200
+    cache_field = f"{credentials_digest(auth)}:{page_cache_field(limit, before)}"
+    if cache:
+        cached_page = cache.get(cache_key, cache_field)
+        if cached_page:
+            print(f"[*] Cache Hit for key: '{cache_key}' page '{cache_field}'")
+            return page_response(cached_page)
 
-    print(f"[*] Cache Miss for key: '{cache_key}'. Fetching from DataNode.")
+    print(f"[*] Cache Miss for key: '{cache_key}' page '{cache_field}'. Fetching from DataNode.")
     print(f"[*] AppNode-{app.port}: Authenticating user '{auth.username}'")
-    payload = {"username": auth.username, "password": auth.password}
+    payload = {"username": auth.username, "password": auth.password, "limit": limit, **before}
     rpc_payload = {"action": "get_data", "data": payload}
-    rpc_response = send_rpc_to_data_node(rpc_payload)
-    
-    # CACHE LOGIC: Populate cache on successful DB read
-    if redis_client and rpc_response.get('status') == 'success':
-        data_to_cache = rpc_response.get('data')
-        if data_to_cache:
-            print(f"[*] Populating cache for key: '{cache_key}' with TTL {CACHE_TTL_SECONDS}s.")
-            redis_client.set(cache_key, json.dumps(data_to_cache), ex=CACHE_TTL_SECONDS)
+    # Taken before the read, so a page that a concurrent write invalidates is not cached
+    snapshot = cache.snapshot(cache_key) if cache else None
+    rpc_response = send_rpc_to_data_node(rpc_payload, auth.username)
     
     status_code = rpc_response.get('code', 500)
-    return jsonify(rpc_response.get('data', {"error": rpc_response.get('error')})), status_code
+    if rpc_response.get('status') != 'success':
+        return jsonify({"error": rpc_response.get('error')}), status_code
+
+    page = page_from(rpc_response)
+    # CACHE LOGIC: Populate cache on successful DB read
+    if cache and page['data']:
+        print(f"[*] Populating cache for key: '{cache_key}' page '{cache_field}' with TTL {CACHE_TTL_SECONDS}s.")
+        cache.set(cache_key, cache_field, page, snapshot)
+    return page_response(page, status_code)
 
 @app.route('/record', methods=['POST'])
 def add_record():
@@ -121,72 +261,163 @@ def add_record():
     payload = request.get_json()
     print(f"[*] AppNode-{app.port}: Payload: {payload}")
     rpc_payload = {"action": "add_record", "data": payload}
-    rpc_response = send_rpc_to_data_node(rpc_payload)
+    rpc_response = send_rpc_to_data_node(rpc_payload, payload.get('patient_uuid'))
     
     # WRITE-THROUGH: Invalidate cache after successful DB write
-    if redis_client and rpc_response.get('status') == 'success':
+    if cache and rpc_response.get('status') == 'success':
         patient_uuid = payload.get('patient_uuid')
         if patient_uuid:
             cache_key_to_invalidate = f"records:{patient_uuid}"
             print(f"[*] Cache Invalidation: Deleting key '{cache_key_to_invalidate}'.")
-            redis_client.delete(cache_key_to_invalidate)
+            cache.delete(cache_key_to_invalidate)
 
     status_code = rpc_response.get('code', 500)
     return jsonify(rpc_response), status_code
 
+@app.route('/records/batch', methods=['POST'])
+def add_records_batch():
+    print(f"\n--- AppNode-{app.port}: Received request for /records/batch ---")
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+
+    payload = request.get_json()
+    records = payload.get('records') if isinstance(payload, dict) else payload
+    if not isinstance(records, list) or not records:
+        return jsonify({"error": "Body must be a non-empty list of records or {\"records\": [...]}"}), 400
+    print(f"[*] AppNode-{app.port}: Importing {len(records)} records in chunks of {BATCH_CHUNK_SIZE}")
+
+    # Records go to the replicas of their patient, so the import is split by replica set first.
+    shards = {}
+    for index, record in enumerate(records):
+        shard_key = record.get('patient_uuid') if isinstance(record, dict) else None
+        owners = tuple(ring.owners(shard_key)) if isinstance(shard_key, str) else ()
+        shards.setdefault(owners, ([], shard_key))[0].append(index)
+
+    results = []
+    for indexes, shard_key in shards.values():
+        for start in range(0, len(indexes), BATCH_CHUNK_SIZE):
+            chunk_indexes = indexes[start:start + BATCH_CHUNK_SIZE]
+            rpc_payload = {"action": "add_records_batch", "data": {"records": [records[index] for index in chunk_indexes]}}
+            rpc_response = send_rpc_to_data_node(rpc_payload, shard_key)
+            chunk_results = rpc_response.get('results')
+            if chunk_results is None:
+                # The whole chunk failed before any per-row outcome was produced.
+                error = rpc_response.get('error') or rpc_response.get('message')
+                chunk_results = [{"index": index, "status": "error", "error": error} for index in range(len(chunk_indexes))]
+            for result in chunk_results:
+                result['index'] = chunk_indexes[result['index']]
+            results.extend(chunk_results)
+    results.sort(key=lambda result: result['index'])
+
+    inserted = [result for result in results if result['status'] == 'success']
+
+    # WRITE-THROUGH: Invalidate cache for every patient that received records
+    if cache and inserted:
+        keys_to_invalidate = {f"records:{result['patient_uuid']}" for result in inserted}
+        print(f"[*] Cache Invalidation: Deleting {len(keys_to_invalidate)} record keys.")
+        cache.delete(*keys_to_invalidate)
+
+    failed = len(results) - len(inserted)
+    if not failed:
+        status, status_code = "success", 201
+    elif inserted:
+        status, status_code = "partial", 207
+    else:
+        status, status_code = "error", 500
+    return jsonify({"status": status, "inserted": len(inserted), "failed": failed, "results": results}), status_code
+
 @app.route('/records/<string:patient_uuid>', methods=['GET'])
 def get_records(patient_uuid):
     print(f"\n--- AppNode-{app.port}: Received request for /records/{patient_uuid} ---")
+    limit, before = read_page_args()
     
-    # CACHE LOGIC: Check cache first for this patient's records
     cache_key = f"records:{patient_uuid}"
-    if redis_client:
-        cached_data = redis_client.get(cache_key)
-        if cached_data:
-            print(f"[*] Cache Hit for key: '{cache_key}'")
-            return jsonify(json.loads(cached_data)), 200
-            
-    print(f"[*] Cache Miss for key: '{cache_key}'. Fetching from DataNode.")
-    payload = {"uuid": patient_uuid}
+    cache_field = page_cache_field(limit, before)
+    payload = {"uuid": patient_uuid, "limit": limit, **before}
     rpc_payload = {"action": "get_records_by_uuid", "data": payload}
-    rpc_response = send_rpc_to_data_node(rpc_payload)
-    
-    # CACHE LOGIC: Populate cache on successful DB read
-    if redis_client and rpc_response.get('status') == 'success':
-        data_to_cache = rpc_response.get('data')
+
+    def load_page():
+        rpc_response = send_rpc_to_data_node(rpc_payload, patient_uuid)
+        if rpc_response.get('status') != 'success':
+            return {"error": rpc_response.get('error'), "code": rpc_response.get('code', 500)}, False
+        page = page_from(rpc_response)
+        # CACHE LOGIC: Populate cache on successful DB read
         # We cache even empty lists to prevent repeated DB lookups for patients with no records
-        if data_to_cache is not None:
-            print(f"[*] Populating cache for key: '{cache_key}' with TTL {CACHE_TTL_SECONDS}s.")
-            redis_client.set(cache_key, json.dumps(data_to_cache), ex=CACHE_TTL_SECONDS)
-    
-    status_code = rpc_response.get('code', 500)
-    return jsonify(rpc_response.get('data', {"error": rpc_response.get('error')})), status_code
+        if cache and page['data'] is not None:
+            print(f"[*] Populating cache for key: '{cache_key}' page '{cache_field}', fresh for {CACHE_TTL_SECONDS}s.")
+        return page, page['data'] is not None
+
+    # CACHE LOGIC: Check cache first for this page of the patient's records;
+    # an expired or expiring page is still served while load_page refreshes it in the background
+    if cache:
+        cached_page = cache.get(cache_key, cache_field, refresh=load_page)
+        if cached_page:
+            print(f"[*] Cache Hit for key: '{cache_key}' page '{cache_field}'")
+            return page_response(cached_page)
+
+    print(f"[*] Cache Miss for key: '{cache_key}' page '{cache_field}'. Fetching from DataNode.")
+    # CACHE LOGIC: Concurrent misses of this page share one fetch
+    page = cache.load(cache_key, cache_field, load_page) if cache else load_page()[0]
+    if 'error' in page:
+        return jsonify({"error": page['error']}), page['code']
+    return page_response(page)
 
 @app.route('/patients', methods=['GET'])
-def get_all_patients_legacy():
-    print(f"\n--- AppNode-{app.port}: Received LEGACY request for /patients ---")
-    
-    # CACHE LOGIC: Check cache for the list of all patients
-    cache_key = "all_patients"
-    if redis_client:
-        cached_data = redis_client.get(cache_key)
-        if cached_data:
-            print(f"[*] Cache Hit for key: '{cache_key}'")
-            return jsonify(json.loads(cached_data)), 200
-            
-    print(f"[*] Cache Miss for key: '{cache_key}'. Fetching from DataNode.")
-    rpc_payload = { "action": "get_all_patients", "data": {} }
-    response = send_rpc_to_data_node(rpc_payload)
-    
-    # CACHE LOGIC: Populate cache on successful DB read
-    if redis_client and response.get("status") == "success":
-        data_to_cache = response.get("data")
-        if data_to_cache:
-            print(f"[*] Populating cache for key: '{cache_key}' with TTL {CACHE_TTL_SECONDS}s.")
-            redis_client.set(cache_key, json.dumps(data_to_cache), ex=CACHE_TTL_SECONDS)
-    
-    status_code = 200 if response.get("status") == "success" else 500
-    return jsonify(response.get("data", [])), status_code
+def get_all_patients():
+    """
+    One page of patients in name order, as a list. Accepts ?limit=&offset= and
+    ?name_prefix= (matched against "first last"); X-Next-Offset points at the
+    next page. Every data node is asked for its share in parallel, with the
+    filters and limit pushed down, and the sorted answers are heap-merged.
+    """
+    print(f"\n--- AppNode-{app.port}: Received request for /patients ---")
+    limit = max(1, min(request.args.get('limit', DEFAULT_PATIENT_PAGE, type=int), MAX_PATIENT_PAGE))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    name_prefix = request.args.get('name_prefix', '')
+
+    cache_field = f"{name_prefix}:{offset}:{limit}"
+
+    def load_page():
+        nodes = sorted(alive_data_nodes)
+        try:
+            rows, has_more, answered = patient_listing.query(nodes, {"name_prefix": name_prefix}, offset, limit)
+        except Exception as e:
+            print(f"[ERROR] Patient listing failed: {e}")
+            return {"error": f"Patient listing failed: {e}", "code": 503}, False
+        if not ring.covered(answered):
+            error_msg = f"Only {len(answered)}/{len(nodes)} data nodes answered; some patients are unavailable."
+            print(f"[ERROR] {error_msg}")
+            return {"error": error_msg, "code": 503}, False
+
+        page = {
+            "data": [{"patient_id": row['uuid'], "name": f"{row['first_name']} {row['last_name']}", "dob": row['dob']} for row in rows],
+            "next_offset": offset + len(rows) if has_more else None,
+        }
+        # CACHE LOGIC: Populate cache on successful read
+        if cache:
+            print(f"[*] Populating cache for key: '{PATIENT_PAGES_KEY}' page '{cache_field}', fresh for {CACHE_TTL_SECONDS}s.")
+        return page, True
+
+    # CACHE LOGIC: Check cache for this page of the listing; an expired or
+    # expiring page is still served while load_page refreshes it in the background
+    if cache:
+        cached_page = cache.get(PATIENT_PAGES_KEY, cache_field, refresh=load_page)
+        if cached_page:
+            print(f"[*] Cache Hit for key: '{PATIENT_PAGES_KEY}' page '{cache_field}'")
+            return patients_response(cached_page)
+
+    print(f"[*] Cache Miss for key: '{PATIENT_PAGES_KEY}' page '{cache_field}'. Scattering to DataNodes.")
+    # CACHE LOGIC: Concurrent misses of this page share one scatter-gather
+    page = cache.load(PATIENT_PAGES_KEY, cache_field, load_page) if cache else load_page()[0]
+    if 'error' in page:
+        return jsonify({"error": page['error']}), page['code']
+    return patients_response(page)
+
+def patients_response(page):
+    response = jsonify(page['data'])
+    if page.get('next_offset') is not None:
+        response.headers[NEXT_OFFSET_HEADER] = str(page['next_offset'])
+    return response, 200
 
 if __name__ == '__main__':
     if len(sys.argv) != 2:
@@ -194,5 +425,7 @@ if __name__ == '__main__':
         sys.exit(1)
     
     app.port = int(sys.argv[1])
+    membership = Membership("app_node", "127.0.0.1", app.port)
+    membership.add_listener(on_membership_change)
     print(f"Application Node is running on http://127.0.0.1:{app.port}")
     app.run(port=app.port, debug=False)
\ No newline at end of file
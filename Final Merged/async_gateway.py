@@ -0,0 +1,105 @@
+import asyncio
+import time
+import aiohttp
+from aiohttp import web
+from load_balancer import (
+    balancer, join_cluster, forwardable_headers, GATEWAY_HOST, GATEWAY_PORT, POOL_MAXSIZE_PER_NODE,
+    STREAM_CHUNK_SIZE, UPSTREAM_TIMEOUT, RETRY_METHODS, NODE_FAILURE_STATUSES,
+)
+
+# --- Configuration ---
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+    'Access-Control-Allow-Headers': 'Authorization, Content-Type',
+}
+
+# --- Upstream Session ---
+# A single client session is shared by every client connection. Its connector
+# keeps at most POOL_MAXSIZE_PER_NODE keep-alive connections open to each app
+# node, and requests beyond that wait for a free connection instead of opening more.
+async def create_upstream_session(app):
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=POOL_MAXSIZE_PER_NODE, keepalive_timeout=30)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=UPSTREAM_TIMEOUT, sock_read=UPSTREAM_TIMEOUT)
+    app['upstream'] = aiohttp.ClientSession(connector=connector, timeout=timeout, auto_decompress=False, cookie_jar=aiohttp.DummyCookieJar())
+    yield
+    await app['upstream'].close()
+
+# --- Generic Proxy/Forwarding Route ---
+async def proxy_request(request):
+    """
+    Asyncio counterpart of api_gateway.proxy_request: the same catch-all routing,
+    node selection and retry rules, without pinning a thread per in-flight call.
+    """
+    if request.method == 'OPTIONS':
+        return web.Response(status=200, headers=CORS_HEADERS)
+
+    path = request.match_info['path']
+    attempts = 2 if request.method in RETRY_METHODS and not request.body_exists else 1
+    tried = []
+    for _ in range(attempts):
+        backend = balancer.acquire(exclude=tried)
+        if backend is None:
+            break
+        tried.append(backend.url)
+        response = await forward_to(request, backend, path)
+        if response is not None:
+            return response
+
+    return web.json_response({"error": "Service unavailable"}, status=503, headers=CORS_HEADERS)
+
+async def forward_to(request, backend, path):
+    """Streams the request to one backend and the reply back. Returns None if the node could not be reached."""
+    url = f"{backend.url}/{path}"
+    if request.query_string:
+        url = f"{url}?{request.query_string}"
+
+    print(f"API Gateway forwarding request for '{path}' to {backend.url}")
+
+    started = time.time()
+    try:
+        body = request.content.iter_chunked(STREAM_CHUNK_SIZE) if request.body_exists else None
+        upstream = await request.app['upstream'].request(
+            request.method, url,
+            headers=dict(forwardable_headers(request.headers)),
+            data=body,
+            allow_redirects=False,
+        )
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error forwarding request to {backend.url}: {e}")
+        balancer.record_failure(backend)
+        balancer.release(backend)
+        return None
+
+    if upstream.status in NODE_FAILURE_STATUSES:
+        balancer.record_failure(backend)
+    else:
+        balancer.record_success(backend, time.time() - started)
+
+    response = web.StreamResponse(status=upstream.status, headers=forwardable_headers(upstream.headers))
+    response.headers.update(CORS_HEADERS)
+    try:
+        await response.prepare(request)
+        async for chunk in upstream.content.iter_chunked(STREAM_CHUNK_SIZE):
+            await response.write(chunk)
+        await response.write_eof()
+    except ConnectionResetError:
+        print(f"Client disconnected before the response for '{path}' was relayed")
+    finally:
+        upstream.release()
+        balancer.release(backend)
+    return response
+
+def create_app():
+    app = web.Application()
+    app.cleanup_ctx.append(create_upstream_session)
+    app.router.add_route('*', '/{path:.*}', proxy_request)
+    return app
+
+def main(host=GATEWAY_HOST, port=GATEWAY_PORT):
+    join_cluster(port)
+    print(f"API Gateway (asyncio engine) is running on http://{host}:{port}")
+    web.run_app(create_app(), host=host, port=port, print=None)
+
+if __name__ == '__main__':
+    main()
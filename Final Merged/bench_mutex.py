@@ -0,0 +1,67 @@
+import sys
+import threading
+import time
+from Mutex import LOCK_BACKENDS
+
+# Measures enter_CS latency and the messages each entry costs for every lock
+# manager in Mutex.LOCK_BACKENDS: uncontended, with every process competing
+# for one resource, and with each process on a resource of its own.
+#
+# Usage: python bench_mutex.py [processes] [entries_per_process] [backend]
+
+BASE_PORT = 3901
+PORTS_PER_BACKEND = 20
+HOLD_TIME = 0.001 # Seconds each entry spends inside the critical section
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def report(label, samples, elapsed, messages):
+    print(f"{label:<14} {len(samples):6d} entries   {len(samples) / elapsed:8.1f} entries/s   "
+          f"{messages / len(samples):5.1f} msgs/entry   "
+          f"p50 {percentile(samples, 0.5) * 1000:8.3f} ms   p99 {percentile(samples, 0.99) * 1000:8.3f} ms")
+
+def enter_and_exit(mutex, ip_list, entries, samples, in_section, resource):
+    for _ in range(entries):
+        started = time.perf_counter()
+        mutex.enter_CS(time=time.time(), ip_list=ip_list, resource=resource)
+        samples.append(time.perf_counter() - started)
+        if not in_section[resource].acquire(blocking=False):
+            raise AssertionError(f"Two processes held '{resource}' at once")
+        time.sleep(HOLD_TIME)
+        in_section[resource].release()
+        mutex.exit_CS(resource=resource)
+
+def messages_sent(mutexes):
+    return sum(mutex.channel.messages_sent for mutex in mutexes)
+
+def run(label, mutexes, ip_list, entries, resources, group):
+    samples = []
+    messages_before = messages_sent(group)
+    in_section = {resource: threading.Lock() for resource in resources}
+    threads = [threading.Thread(target=enter_and_exit, args=(mutex, ip_list, entries, samples, in_section, resource))
+               for mutex, resource in zip(mutexes, resources)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report(label, samples, time.perf_counter() - started, messages_sent(group) - messages_before)
+
+def main(processes=3, entries=200, backends=None):
+    for index, backend in enumerate(backends or LOCK_BACKENDS):
+        base_port = BASE_PORT + index * PORTS_PER_BACKEND
+        ip_list = [base_port + i for i in range(processes)]
+        mutexes = [LOCK_BACKENDS[backend](port) for port in ip_list]
+        time.sleep(0.2)
+
+        print(f"--- {backend}, {processes} processes ---")
+        # The uncontended run uses a process other than the lease leader, so both backends pay the network.
+        run("uncontended", mutexes[-1:], ip_list, entries, ["patient-0"], mutexes)
+        run("one resource", mutexes, ip_list, entries, ["patient-0"] * processes, mutexes)
+        run("per resource", mutexes, ip_list, entries, [f"patient-{i}" for i in range(processes)], mutexes)
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    main(*args, backends=sys.argv[3:4] or None)
@@ -0,0 +1,68 @@
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import binary_rpc
+from data_node import PooledXMLRPCServer, KeepAliveRequestHandler
+from rpc_pool import RPCConnectionPool
+
+# Compares XML-RPC with the binary msgpack transport on the app-node to
+# data-node hop, using replies shaped like a patient's record history.
+#
+# Usage: python bench_rpc.py [records_per_reply] [calls] [client_threads]
+
+HOST = '127.0.0.1'
+XMLRPC_PORT = 7901
+BINARY_PORT = 8901
+
+def make_records(count):
+    patient_uuid = str(uuid.uuid4())
+    return [{
+        "record_id": str(uuid.uuid4()), "patient_uuid": patient_uuid, "doctor_name": "Dr. Bench",
+        "description": "Routine check-up, blood pressure normal.", "resources_used": "Stethoscope",
+        "prescription": "Rest and fluids", "timestamp": time.time() * 1000 + i,
+    } for i in range(count)]
+
+def start_servers(records):
+    def dispatch_rpc(action, data):
+        return {"status": "success", "code": 200, "data": records}
+
+    xml_server = PooledXMLRPCServer((HOST, XMLRPC_PORT), requestHandler=KeepAliveRequestHandler, allow_none=True, logRequests=False)
+    xml_server.register_function(dispatch_rpc, 'dispatch_rpc')
+    threading.Thread(target=xml_server.serve_forever, daemon=True).start()
+
+    binary_server = binary_rpc.BinaryRPCServer((HOST, BINARY_PORT), dispatch_rpc)
+    threading.Thread(target=binary_server.serve_forever, daemon=True).start()
+
+def run(label, call, calls, threads):
+    call()  # Warm up: open the connection before timing
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda _: call(), range(calls)))
+    elapsed = time.perf_counter() - started
+    print(f"{label:<10} {calls / elapsed:10.1f} calls/s   {elapsed / calls * 1000:8.3f} ms/call")
+
+def main(records_per_reply=100, calls=2000, threads=8):
+    if not binary_rpc.is_available():
+        print("msgpack is not installed; only XML-RPC can be measured.")
+        sys.exit(1)
+    start_servers(make_records(records_per_reply))
+    time.sleep(0.2)
+
+    pool = RPCConnectionPool(HOST, XMLRPC_PORT, max_size=threads)
+    def xmlrpc_call():
+        with pool.connection() as proxy:
+            return proxy.dispatch_rpc("get_records_by_uuid", {"uuid": "bench"})
+
+    client = binary_rpc.BinaryRPCClient(HOST, BINARY_PORT)
+    def binary_call():
+        return client.call("get_records_by_uuid", {"uuid": "bench"})
+
+    print(f"{records_per_reply} records per reply, {calls} calls, {threads} client threads")
+    run("xmlrpc", xmlrpc_call, calls, threads)
+    run("binary", binary_call, calls, threads)
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:4]]
+    main(*args)
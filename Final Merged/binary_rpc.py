@@ -0,0 +1,198 @@
+import itertools
+import socket
+import socketserver
+import struct
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    import msgpack
+except ImportError:
+    # Without msgpack the binary transport is unavailable and every hop stays on XML-RPC.
+    msgpack = None
+
+# --- Protocol Configuration ---
+# Every message is a 4-byte big-endian length followed by a msgpack body.
+#   request:  [request_id, action, data]
+#   response: [request_id, response]
+# Request ids let many calls share one connection and complete out of order.
+HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+BINARY_PORT_OFFSET = 1000      # A data node on port 7001 serves the binary protocol on 8001
+DEFAULT_TIMEOUT = 30
+DEFAULT_WORKERS = 16
+DEFAULT_MAX_QUEUE_DEPTH = 64
+OVERLOADED_RESPONSE = {"status": "error", "code": 503, "error": "Data node is overloaded, try again later"}
+
+
+def is_available():
+    return msgpack is not None
+
+def encode_frame(message):
+    body = msgpack.packb(message, use_bin_type=True)
+    return HEADER.pack(len(body)) + body
+
+def read_frame(rfile):
+    """Reads one framed message from a buffered file object. Returns None on a clean EOF."""
+    header = rfile.read(HEADER.size)
+    if not header:
+        return None
+    if len(header) < HEADER.size:
+        raise ConnectionError("Connection closed in the middle of a frame header")
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ConnectionError(f"Frame of {length} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    body = rfile.read(length)
+    if len(body) < length:
+        raise ConnectionError("Connection closed in the middle of a frame body")
+    return msgpack.unpackb(body, raw=False)
+
+
+# --- Server ---
+class BinaryRPCHandler(socketserver.StreamRequestHandler):
+    """Reads requests off one persistent connection and runs them on the server's worker pool."""
+    def handle(self):
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        write_lock = threading.Lock()
+        while True:
+            try:
+                frame = read_frame(self.rfile)
+            except (ConnectionError, OSError, ValueError) as e:
+                print(f"[BinaryRPC] Dropping connection from {self.client_address}: {e}")
+                break
+            if frame is None:
+                break
+            request_id, action, data = frame
+            if self.server.admit():
+                self.server.executor.submit(self.run_request, request_id, action, data, write_lock)
+            else:
+                self.send_response(request_id, OVERLOADED_RESPONSE, write_lock)
+
+    def run_request(self, request_id, action, data, write_lock):
+        try:
+            response = self.server.dispatch(action, data)
+        except Exception as e:
+            response = {"status": "error", "code": 500, "message": f"An internal error occurred: {e}"}
+        finally:
+            self.server.release()
+        self.send_response(request_id, response, write_lock)
+
+    def send_response(self, request_id, response, write_lock):
+        frame = encode_frame([request_id, response])
+        with write_lock:
+            try:
+                self.connection.sendall(frame)
+            except OSError:
+                pass # The client went away; nobody is waiting for this response.
+
+
+class BinaryRPCServer(socketserver.ThreadingTCPServer):
+    """
+    Serves dispatch(action, data) over framed msgpack, one reader thread per
+    connection. Requests run on a bounded worker pool; once workers plus
+    max_queue_depth requests are outstanding, new ones are answered with a 503.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, dispatch, workers=DEFAULT_WORKERS, max_queue_depth=DEFAULT_MAX_QUEUE_DEPTH):
+        super().__init__(address, BinaryRPCHandler)
+        self.dispatch = dispatch
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="binary-rpc")
+        self.max_outstanding = workers + max_queue_depth
+        self.outstanding = 0
+        self.outstanding_lock = threading.Lock()
+
+    def admit(self):
+        with self.outstanding_lock:
+            if self.outstanding >= self.max_outstanding:
+                return False
+            self.outstanding += 1
+            return True
+
+    def release(self):
+        with self.outstanding_lock:
+            self.outstanding -= 1
+
+
+# --- Client ---
+class BinaryRPCClient:
+    """
+    A single persistent, multiplexed connection to a BinaryRPCServer. Any number
+    of threads may call() concurrently; a reader thread matches responses to
+    waiting callers by request id.
+    """
+    def __init__(self, host, port, timeout=DEFAULT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.lock = threading.RLock()
+        self.sock = None
+        self.pending = {}
+        self.ids = itertools.count(1)
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(None)
+        self.sock = sock
+        reader = threading.Thread(target=self._reader, args=(sock,), daemon=True)
+        reader.start()
+
+    def _reader(self, sock):
+        rfile = sock.makefile("rb")
+        error = ConnectionError(f"Connection to {self.host}:{self.port} was closed")
+        try:
+            while True:
+                frame = read_frame(rfile)
+                if frame is None:
+                    break
+                request_id, response = frame
+                with self.lock:
+                    waiter = self.pending.pop(request_id, None)
+                if waiter is not None:
+                    waiter.set_result(response)
+        except (ConnectionError, OSError, ValueError) as e:
+            error = ConnectionError(f"Connection to {self.host}:{self.port} failed: {e}")
+        finally:
+            rfile.close()
+            self._drop(sock, error)
+
+    def _drop(self, sock, error):
+        """Closes a broken connection and fails every call still waiting on it."""
+        with self.lock:
+            if self.sock is not sock:
+                return
+            self.sock = None
+            waiting, self.pending = self.pending, {}
+        try:
+            sock.close()
+        except OSError:
+            pass
+        for waiter in waiting.values():
+            waiter.set_exception(error)
+
+    def call(self, action, data, timeout=None):
+        waiter = Future()
+        with self.lock:
+            if self.sock is None:
+                self._connect()
+            sock = self.sock
+            request_id = next(self.ids)
+            self.pending[request_id] = waiter
+            try:
+                sock.sendall(encode_frame([request_id, action, data]))
+            except OSError as e:
+                self._drop(sock, ConnectionError(f"Send to {self.host}:{self.port} failed: {e}"))
+        try:
+            return waiter.result(timeout or self.timeout)
+        except TimeoutError:
+            with self.lock:
+                self.pending.pop(request_id, None)
+            raise
+
+    def close(self):
+        with self.lock:
+            sock = self.sock
+        if sock is not None:
+            self._drop(sock, ConnectionError("Client closed"))
@@ -0,0 +1,392 @@
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+
+# --- Default Configuration ---
+DEFAULT_LOCAL_MAX_BYTES = 64 * 1024 * 1024  # Serialized bytes the in-process tier may hold
+DEFAULT_LOCAL_TTL = 30          # Seconds a local copy lives, a backstop should an invalidation be missed
+DEFAULT_REDIS_TTL = 300         # Seconds until a cached page is due for a refresh
+DEFAULT_STALE_TTL = 300         # Seconds past that an expired page may still be served while it is refreshed
+DEFAULT_XFETCH_BETA = 1.0       # How early refreshes start, in multiples of a page's load time; 0 waits for expiry
+DEFAULT_REFRESH_WORKERS = 4     # Background refreshes run at once
+INVALIDATION_CHANNEL = "cache_invalidations"
+INVALIDATION_COUNT_PREFIX = "invalidations:"  # Redis counter per key, bumped by every delete()
+RESUBSCRIBE_DELAY = 1           # Seconds between attempts to re-subscribe after Redis drops the connection
+LOAD_LOCK_PREFIX = "load_lock:"
+LOAD_LOCK_TTL_MS = 3000         # Longest a load lock is held, should the App Node holding it die mid-load
+LOAD_POLL_INTERVAL = 0.02       # Seconds between checks for a page another App Node is loading
+
+
+class LocalCache:
+    """
+    An in-process LRU of (key, field) -> value, bounded by the bytes of the
+    values' serialized form and with a TTL per entry.
+
+    Values are kept already parsed, so a hit costs neither a Redis round trip
+    nor a json.loads. Dropping a key drops all of its fields and bumps the
+    key's generation; a put that started before the drop (generation() was
+    read earlier) is ignored, so a slow reader cannot bring back a stale value.
+    """
+    def __init__(self, max_bytes=DEFAULT_LOCAL_MAX_BYTES, ttl=DEFAULT_LOCAL_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # (key, field) -> (value, size, expires), least recently used first
+        self.fields = {}              # key -> set of its cached fields
+        self.generations = {}         # key -> number of times it has been dropped
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, field):
+        with self.lock:
+            entry = self.entries.get((key, field))
+            if entry is None:
+                return None
+            if entry[2] <= time.monotonic():
+                self._remove((key, field))
+                return None
+            self.entries.move_to_end((key, field))
+            return entry[0]
+
+    def generation(self, key):
+        with self.lock:
+            return self.generations.get(key, 0)
+
+    def put(self, key, field, value, size, generation):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if self.generations.get(key, 0) != generation:
+                return
+            if (key, field) in self.entries:
+                self._remove((key, field))
+            self.entries[(key, field)] = (value, size, time.monotonic() + self.ttl)
+            self.fields.setdefault(key, set()).add(field)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def drop(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.generations[key] = self.generations.get(key, 0) + 1
+                for field in list(self.fields.get(key, ())):
+                    self._remove((key, field))
+
+    def _remove(self, entry_key):
+        _, size, _ = self.entries.pop(entry_key)
+        self.size -= size
+        key, field = entry_key
+        fields = self.fields[key]
+        fields.discard(field)
+        if not fields:
+            del self.fields[key]
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Callers that arrive while a call
+    for their key is running wait for it and share its result (or exception)
+    instead of making their own.
+    """
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, function):
+        """Returns (result, shared): shared is True when another caller's call produced the result."""
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            flight.result = function()
+            return flight.result, False
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+
+class TwoTierCache:
+    """
+    Pages of JSON values cached in-process (LocalCache) in front of Redis.
+
+    Each Redis key is a hash of pages, as in app_node's page caches. Reads try
+    the local tier, then Redis, and fill the local tier from Redis. Deleting a
+    key removes it from Redis and publishes it on INVALIDATION_CHANNEL; every
+    process, this one included, drops its local copies when the message
+    arrives. It also bumps the key's invalidation count in Redis. A fill
+    notes the count (snapshot()) before it reads the source and only stores
+    its page if the count is unchanged, so a load that read the data before
+    a write cannot put the old page back after the write's delete.
+
+    Misses are filled through load(), which coalesces concurrent misses of a
+    page into one load. With load_lock_ttl_ms set, App Nodes also coalesce
+    with each other through a short Redis lock; 0 keeps coalescing in-process.
+
+    Every page is stored with a soft expiry, redis_ttl after it was loaded,
+    and the time its load took. Redis keeps it stale_ttl seconds longer, and
+    reads that pass a refresh loader are still answered from it while one
+    background refresh replaces it. Refreshes also start early at random,
+    more likely the nearer the expiry and the slower the load (XFetch;
+    xfetch_beta scales how early, 0 turns it off), so a popular page is
+    usually replaced before any reader finds it expired. Reads without a
+    loader treat an expired page as a miss.
+
+    stats() counts hits and misses per tier, loads, misses that shared
+    someone else's load, expired pages served, and background refreshes.
+    """
+    def __init__(self, redis_client, local=None, redis_ttl=DEFAULT_REDIS_TTL, channel=INVALIDATION_CHANNEL,
+                 load_lock_ttl_ms=LOAD_LOCK_TTL_MS, stale_ttl=DEFAULT_STALE_TTL, xfetch_beta=DEFAULT_XFETCH_BETA,
+                 refresh_workers=DEFAULT_REFRESH_WORKERS):
+        self.redis = redis_client
+        self.local = local or LocalCache()
+        self.redis_ttl = redis_ttl
+        self.channel = channel
+        self.load_lock_ttl_ms = load_lock_ttl_ms
+        self.stale_ttl = stale_ttl
+        self.xfetch_beta = xfetch_beta
+        self.flights = SingleFlight()
+        self.refresher = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="cache-refresh")
+        self.refreshing = set()  # (key, field) pages with a refresh queued or running in this process
+        self.refreshing_lock = threading.Lock()
+        self.counters = {"local_hits": 0, "local_misses": 0, "redis_hits": 0, "redis_misses": 0,
+                         "loads": 0, "coalesced": 0, "stale_hits": 0, "refreshes": 0}
+        self.counters_lock = threading.Lock()
+        subscriber = threading.Thread(target=self.invalidation_daemon, daemon=True)
+        subscriber.start()
+
+    def count(self, counter):
+        with self.counters_lock:
+            self.counters[counter] += 1
+
+    def stats(self):
+        with self.counters_lock:
+            stats = dict(self.counters)
+        stats.update(local_entries=len(self.local.entries), local_bytes=self.local.size)
+        return stats
+
+    def get(self, key, field, refresh=None):
+        """
+        Returns the cached value, or None on a miss in both tiers. refresh is a
+        loader as for load(); with it a page that is expiring, or expired less
+        than stale_ttl ago, is still returned, and refreshed in the background.
+        """
+        entry = self.lookup(key, field)
+        if entry is None:
+            return None
+        now = time.time()
+        if now >= entry["soft_expiry"] + self.stale_ttl:
+            return None
+        expired = now >= entry["soft_expiry"]
+        if refresh is None:
+            return None if expired else entry["value"]
+        if expired:
+            self.count("stale_hits")
+            self.start_refresh(key, field, refresh, entry["soft_expiry"])
+        elif self.xfetch_beta and now - entry["delta"] * self.xfetch_beta * math.log(1.0 - random.random()) >= entry["soft_expiry"]:
+            self.start_refresh(key, field, refresh, entry["soft_expiry"])
+        return entry["value"]
+
+    def lookup(self, key, field):
+        """The page's entry ({"value", "soft_expiry", "delta"}) from the nearest tier that has it, or None."""
+        entry = self.local.get(key, field)
+        if entry is not None:
+            self.count("local_hits")
+            return entry
+        self.count("local_misses")
+        generation = self.local.generation(key)
+        cached = self.redis.hget(key, field)
+        entry = self.parse(cached)
+        if entry is None:
+            self.count("redis_misses")
+            return None
+        self.count("redis_hits")
+        self.local.put(key, field, entry, len(cached), generation)
+        return entry
+
+    def parse(self, cached):
+        entry = json.loads(cached) if cached is not None else None
+        # Pages cached by App Nodes that predate soft expiry are plain values; they count as misses.
+        return entry if isinstance(entry, dict) and "soft_expiry" in entry else None
+
+    def snapshot(self, key):
+        """The key's local generation and Redis invalidation count, to take before reading what will be cached."""
+        return self.local.generation(key), self.redis.get(f"{INVALIDATION_COUNT_PREFIX}{key}")
+
+    def set(self, key, field, value, snapshot=None):
+        """Caches a page. Pass the snapshot(key) taken before value was read, so a delete() since then keeps it out."""
+        self.store(key, field, value, snapshot or self.snapshot(key))
+
+    def store(self, key, field, value, snapshot, delta=0):
+        """Stores the page in both tiers, unless the key was deleted since snapshot was taken."""
+        generation, invalidations = snapshot
+        count_key = f"{INVALIDATION_COUNT_PREFIX}{key}"
+        entry = {"value": value, "soft_expiry": time.time() + self.redis_ttl, "delta": delta}
+        serialized = json.dumps(entry)
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(count_key)
+                if pipe.get(count_key) != invalidations:
+                    return
+                pipe.multi()
+                pipe.hset(key, field, serialized)
+                # Every store extends the hash's TTL to cover the page just cached; get() stops
+                # serving an older page of it once the page is past its own stale window.
+                pipe.expire(key, self.redis_ttl + self.stale_ttl)
+                pipe.execute()
+            except redis.exceptions.WatchError:
+                return # A delete() landed while the page was being stored
+        self.local.put(key, field, entry, len(serialized), generation)
+
+    def run_loader(self, key, field, loader, snapshot):
+        self.count("loads")
+        started = time.monotonic()
+        value, cacheable = loader()
+        if cacheable:
+            self.store(key, field, value, snapshot, time.monotonic() - started)
+        return value
+
+    def load(self, key, field, loader):
+        """
+        Fills a missed page. loader() returns (value, cacheable); the value is
+        returned and, if cacheable, cached. Misses of the same page that arrive
+        while a load is running wait for it and get the same value.
+        """
+        value, shared = self.flights.do((key, field), lambda: self.load_once(key, field, loader))
+        if shared:
+            self.count("coalesced")
+        return value
+
+    def load_once(self, key, field, loader):
+        # A load that finished just before this one started has already cached the page.
+        entry = self.local.get(key, field)
+        if entry is not None and time.time() < entry["soft_expiry"]:
+            return entry["value"]
+        snapshot = self.snapshot(key)
+        lock_key, token = None, None
+        if self.load_lock_ttl_ms:
+            lock_key, token = f"{LOAD_LOCK_PREFIX}{key}:{field}", uuid.uuid4().hex
+            if not self.redis.set(lock_key, token, nx=True, px=self.load_lock_ttl_ms):
+                token = None
+                value = self.wait_for_load(key, field, lock_key, snapshot[0])
+                if value is not None:
+                    self.count("coalesced")
+                    return value
+        try:
+            return self.run_loader(key, field, loader, snapshot)
+        finally:
+            if token:
+                self.release(lock_key, token)
+
+    def wait_for_load(self, key, field, lock_key, generation):
+        """Waits for another App Node's load; None if it ended, or its lock expired, without caching the page."""
+        while True:
+            pipe = self.redis.pipeline()
+            pipe.hget(key, field)
+            pipe.exists(lock_key)
+            cached, loading = pipe.execute()
+            entry = self.parse(cached)
+            if entry is not None and time.time() < entry["soft_expiry"]:
+                self.local.put(key, field, entry, len(cached), generation)
+                return entry["value"]
+            if not loading:
+                return None
+            time.sleep(LOAD_POLL_INTERVAL)
+
+    def start_refresh(self, key, field, loader, soft_expiry):
+        with self.refreshing_lock:
+            if (key, field) in self.refreshing:
+                return
+            self.refreshing.add((key, field))
+        self.refresher.submit(self.refresh, key, field, loader, soft_expiry)
+
+    def refresh(self, key, field, loader, soft_expiry):
+        """Reloads a page that was served expired or expiring, unless another App Node already has or is doing so."""
+        try:
+            snapshot = self.snapshot(key)
+            cached = self.redis.hget(key, field)
+            entry = self.parse(cached)
+            if entry is not None and entry["soft_expiry"] > soft_expiry:
+                self.local.put(key, field, entry, len(cached), snapshot[0])
+                return
+            lock_key, token = None, None
+            if self.load_lock_ttl_ms:
+                lock_key, token = f"{LOAD_LOCK_PREFIX}{key}:{field}", uuid.uuid4().hex
+                if not self.redis.set(lock_key, token, nx=True, px=self.load_lock_ttl_ms):
+                    return
+            try:
+                self.count("refreshes")
+                self.run_loader(key, field, loader, snapshot)
+            finally:
+                if token:
+                    self.release(lock_key, token)
+        except Exception as e:
+            print(f"[WARNING] Cache refresh of '{key}' page '{field}' failed: {e}")
+        finally:
+            with self.refreshing_lock:
+                self.refreshing.discard((key, field))
+
+    def release(self, lock_key, token):
+        """Deletes the load lock unless it expired and another App Node has taken it since."""
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(lock_key)
+                if pipe.get(lock_key) == token:
+                    pipe.multi()
+                    pipe.delete(lock_key)
+                    pipe.execute()
+            except redis.exceptions.WatchError:
+                pass # The lock changed hands while being released; it is no longer ours to delete
+
+    def delete(self, *keys):
+        """Removes keys from Redis and from the local tier of every process."""
+        if not keys:
+            return
+        self.local.drop(*keys)
+        pipe = self.redis.pipeline()
+        pipe.delete(*keys)
+        for key in keys:
+            count_key = f"{INVALIDATION_COUNT_PREFIX}{key}"
+            pipe.incr(count_key)
+            # It only has to outlive the loads in flight, which end long before this.
+            pipe.expire(count_key, self.redis_ttl + self.stale_ttl)
+        pipe.publish(self.channel, json.dumps(keys))
+        pipe.execute()
+
+    def invalidation_daemon(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Anything cached while unsubscribed may have missed an invalidation.
+                self.local.drop(*list(self.local.fields))
+                for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.local.drop(*json.loads(message["data"]))
+            except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as e:
+                print(f"[WARNING] Cache invalidation subscriber lost Redis: {e}")
+                time.sleep(RESUBSCRIBE_DELAY)
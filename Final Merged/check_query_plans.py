@@ -0,0 +1,22 @@
+import sqlite3
+import sys
+from data_node import HOT_QUERIES, migrate_schema, check_query_plans
+
+# Fails (exit status 1) when a query in data_node.HOT_QUERIES would scan a
+# table or sort in a temporary B-tree instead of reading an index. Checks a
+# fresh in-memory database built by the migrations, or an existing database.
+#
+# Usage: python check_query_plans.py [db_file]
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        conn = sqlite3.connect(f"file:{sys.argv[1]}?mode=ro", uri=True)
+    else:
+        conn = sqlite3.connect(":memory:", isolation_level=None)
+        migrate_schema(conn)
+    regressions = check_query_plans(conn)
+    for name, plan in regressions.items():
+        print(f"[FAILURE] Query '{name}' is not index-backed: {plan}")
+    if regressions:
+        sys.exit(1)
+    print(f"[SUCCESS] All {len(HOT_QUERIES)} hot queries are index-backed.")
@@ -1,120 +1,514 @@
 import sys
+import hashlib
+import json
 import sqlite3
 import threading
 import uuid
 import time
 import xmlrpc.client
-from xmlrpc.server import SimpleXMLRPCServer
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from CAF import CAF_Clock 
-from Mutex import RicAgra
+from rpc_pool import NodeRPCClient
+from db_pool import SQLiteConnectionPool, enable_wal
+from replication import ReplicationEngine, HintedHandoff
+from anti_entropy import AntiEntropy, prefix_upper_bound
+import binary_rpc
+from Mutex import LOCK_BACKENDS
+from membership import Membership
+from sharding import HashRing, SHARD_COLUMNS, ring_hash, in_ranges, encode_ranges, decode_ranges
 
 # --- Configuration ---
-DATA_NODE_PEERS = [
-    ('127.0.0.1', 7001),
-    ('127.0.0.1', 7002),
-    ('127.0.0.1', 7003),
-]
+# Data nodes, with their clock and lock ports, are listed in cluster.json; see membership.py.
+# Each patient lives on sharding.REPLICATION_FACTOR of them; the quorums below count those replicas.
 QUORUM_W = 2
 QUORUM_R = 2
+REPLICATION_TIMEOUT = 5    # Seconds a write waits for QUORUM_W acknowledgements, or a read for QUORUM_R matching replies
+RPC_PROTOCOL = "auto"      # Protocol for node-to-node calls: "xmlrpc", "binary", or "auto"
+BINARY_RPC_ENABLED = True  # Serve the binary protocol next to XML-RPC on port + BINARY_PORT_OFFSET
+ANTI_ENTROPY_INTERVAL = 60 # Seconds between Merkle-tree resync rounds with each peer
+LOCK_BACKEND = "ricart_agrawala" # Distributed lock manager: "ricart_agrawala" (all-to-all) or "lease" (leader leases)
+REPLICATED_TABLES = {"users": "uuid", "records": "record_id", "usernames": "username"} # Replicated tables and their primary keys, users first
+BATCH_RECORD_TYPES = {"users": "user_batch", "records": "record_batch", "usernames": "username_batch"} # replicate_write type for a table's rows
+
+MAX_PAGE_SIZE = 500        # Upper bound on records returned by one paginated read
+MAX_BATCH_SIZE = 1000      # Upper bound on records accepted by one add_records_batch call
+SHARD_SCAN_BATCH = 2000    # Rows a node scans per shard_rows call while streaming ranges to a new owner
+
+# --- Server Concurrency Configuration ---
+SERVER_WORKERS = 32        # Worker threads serving RPC connections / binary requests
+MAX_QUEUE_DEPTH = 64       # Work allowed to wait for a free worker; anything beyond is shed with a 503
+KEEPALIVE_TIMEOUT = 15     # Seconds an idle kept-alive XML-RPC connection may hold a worker
+
+# --- SQLite Configuration ---
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024  # Bytes of the database file to memory-map
+SQLITE_CACHE_SIZE_KB = 64 * 1024      # Page cache per connection
+SQLITE_BUSY_TIMEOUT = 5               # Seconds a writer waits for the write lock
 
 # --- Global State ---
 NODE_PORT = 0
 DB_NAME_GLOBAL = "" # To store the database name for the dispatcher
+db_pool = None      # Per-thread SQLite connections, created in main()
+replication_engine = None # Long-lived fan-out to the peers, created in main()
+hinted_handoff = None     # Durable backlog of writes that peers missed, created in main()
+anti_entropy = None       # Background Merkle-tree resync with the peers, created in main()
 caf_clock = None
 RA = None
+membership = None   # This node's view of the cluster, created in main()
+NODE_ADDRESS = None # This node's (host, port), as placed on the ring
+ring = None         # Placement of patients on the data nodes, rebuilt when the node set changes
+peer_clients = {}   # (host, port) -> NodeRPCClient, created on first use
+peer_clients_lock = threading.Lock()
+lock_context = threading.local() # .fence: the lease fencing token the current handler writes under, if any
 
-# --- Database Initialization (No changes needed) ---
-def init_db(db_name):
-    """Initializes the SQLite database with the updated schema (no logical_clock)."""
-    conn = sqlite3.connect(db_name, check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
+# --- XML-RPC Server Classes ---
+class KeepAliveRequestHandler(SimpleXMLRPCRequestHandler):
+    # HTTP/1.1 lets pooled clients send many calls over one connection.
+    protocol_version = "HTTP/1.1"
+    # Idle connections are closed after this long so they do not pin a worker forever.
+    timeout = KEEPALIVE_TIMEOUT
+
+class PooledXMLRPCServer(SimpleXMLRPCServer):
+    """
+    Serves connections on a bounded pool of worker threads. Connections that
+    arrive while every worker is busy wait in a queue of at most
+    max_queue_depth; beyond that they are refused with a 503 straight away.
+    """
+    request_queue_size = 128 # Listen backlog
+
+    def __init__(self, addr, workers=SERVER_WORKERS, max_queue_depth=MAX_QUEUE_DEPTH, **kwargs):
+        super().__init__(addr, **kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="xmlrpc-worker")
+        self.max_admitted = workers + max_queue_depth
+        self.admitted = 0
+        self.admitted_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self.admitted_lock:
+            shed = self.admitted >= self.max_admitted
+            if not shed:
+                self.admitted += 1
+        if shed:
+            print(f"[WARNING] DataNode-{NODE_PORT}: Overloaded, shedding connection from {client_address}")
+            self.shed_request(request)
+            return
+        self.executor.submit(self.process_request_worker, request, client_address)
+
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self.admitted_lock:
+                self.admitted -= 1
+
+    def shed_request(self, request):
+        try:
+            request.sendall(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+# --- Database Schema ---
+# Each migration moves the database from version N-1 to N, tracked in PRAGMA
+# user_version. Append new steps to the end; never edit one that has shipped.
+SCHEMA_MIGRATIONS = [
+    (1, [
+        '''CREATE TABLE IF NOT EXISTS users (
             uuid TEXT PRIMARY KEY, username TEXT UNIQUE NOT NULL, first_name TEXT NOT NULL,
             last_name TEXT NOT NULL, dob TEXT NOT NULL, password TEXT NOT NULL
-        )''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS records (
+        )''',
+        '''CREATE TABLE IF NOT EXISTS records (
             record_id TEXT PRIMARY KEY, patient_uuid TEXT NOT NULL, doctor_name TEXT,
             description TEXT, resources_used TEXT, prescription TEXT,
             timestamp REAL,
             FOREIGN KEY (patient_uuid) REFERENCES users (uuid)
-        )''')
-    conn.commit()
+        )''',
+    ]),
+    (2, [
+        # A patient's history newest-first comes straight off this index: no scan, no sort.
+        "CREATE INDEX IF NOT EXISTS idx_records_patient_ts ON records (patient_uuid, timestamp DESC)",
+        # Covers the patient listing, which then never touches the wider users rows.
+        "CREATE INDEX IF NOT EXISTS idx_users_listing ON users (first_name, last_name, uuid, dob)",
+    ]),
+    (3, [
+        # Every write stamps its rows with the CAF-synchronized time it was made, in ms.
+        # Replicas keep the highest version, and quorum reads compare versions to spot stale copies.
+        "ALTER TABLE users ADD COLUMN version REAL NOT NULL DEFAULT 0",
+        "ALTER TABLE records ADD COLUMN version REAL NOT NULL DEFAULT 0",
+        # The patient listing now reads the version too, so the covering index carries it.
+        "DROP INDEX IF EXISTS idx_users_listing",
+        "CREATE INDEX IF NOT EXISTS idx_users_listing ON users (first_name, last_name, uuid, dob, version)",
+    ]),
+    (4, [
+        # The highest lease fencing token each lock resource has written under; older tokens are refused.
+        "CREATE TABLE IF NOT EXISTS fences (resource TEXT PRIMARY KEY, token INTEGER NOT NULL)",
+    ]),
+    (5, [
+        # Maps each username to its patient's random uuid. It is placed on the ring by
+        # username, so a login finds the uuid, and from it the patient's replicas.
+        "CREATE TABLE IF NOT EXISTS usernames (username TEXT PRIMARY KEY, uuid TEXT NOT NULL, version REAL NOT NULL DEFAULT 0)",
+        # Existing accounts get their entries from the users rows this node already holds.
+        "INSERT OR IGNORE INTO usernames (username, uuid, version) SELECT username, uuid, version FROM users",
+    ]),
+    (6, [
+        # Pages are cut on (timestamp, record_id), so records that share a timestamp are
+        # neither skipped nor repeated at a page boundary; the index serves that order directly.
+        "DROP INDEX IF EXISTS idx_records_patient_ts",
+        "CREATE INDEX IF NOT EXISTS idx_records_patient_ts_id ON records (patient_uuid, timestamp DESC, record_id DESC)",
+    ]),
+]
+
+# Queries on the read path that must be served from an index.
+HOT_QUERIES = {
+    "username lookup": ("SELECT * FROM usernames WHERE username = ?", ("",)),
+    "get_data (user)": ("SELECT * FROM users WHERE uuid = ?", ("",)),
+    "get_data / get_records_by_uuid": ("SELECT * FROM records WHERE patient_uuid = ? ORDER BY timestamp DESC, record_id DESC", ("",)),
+    "records page": ("SELECT * FROM records WHERE patient_uuid = ? AND (timestamp, record_id) < (?, ?) "
+                     "ORDER BY timestamp DESC, record_id DESC LIMIT ?", ("", 0, "", 1)),
+    "list_patients": ("SELECT uuid, first_name, last_name, dob, version FROM users WHERE first_name >= ? AND first_name < ? "
+                      "AND (first_name, last_name, uuid) > (?, ?, ?) ORDER BY first_name, last_name, uuid LIMIT ?",
+                      ("", "z", "", "", "", 1)),
+}
+
+def migrate_schema(conn):
+    """
+    Applies every migration newer than the database's user_version, each in its
+    own transaction. conn must be in autocommit mode (isolation_level=None):
+    otherwise sqlite3 commits every DDL statement on its own, and a crash midway
+    through a step leaves it half applied.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, statements in SCHEMA_MIGRATIONS:
+        if target <= version:
+            continue
+        conn.execute("BEGIN")
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        print(f"[*] Database migrated to schema version {target}")
+        version = target
+    return version
+
+def check_query_plans(conn):
+    """
+    Runs EXPLAIN QUERY PLAN over HOT_QUERIES and returns the ones that fall back
+    to a full table scan or a temporary sort, so a lost index shows up at startup.
+    """
+    regressions = {}
+    for name, (query, params) in HOT_QUERIES.items():
+        plan = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+        uses_index = all("INDEX" in step or not step.startswith("SCAN") for step in plan)
+        if not uses_index or any("TEMP B-TREE" in step for step in plan):
+            regressions[name] = plan
+    return regressions
+
+# --- Database Initialization ---
+def init_db(db_name):
+    """Initializes the SQLite database in WAL mode and brings its schema up to the latest version."""
+    enable_wal(db_name)
+    conn = sqlite3.connect(db_name, check_same_thread=False, isolation_level=None)
+    version = migrate_schema(conn)
+    for name, plan in check_query_plans(conn).items():
+        print(f"[WARNING] Query '{name}' is not index-backed: {plan}")
     conn.close()
-    print(f"Database '{db_name}' initialized with the new schema.")
+    print(f"Database '{db_name}' initialized at schema version {version}.")
+
+# --- Mutual Exclusion Helpers ---
+class FencingError(Exception):
+    """A write carried a fencing token older than one its resource has already been written under."""
+
+@contextmanager
+def critical_section(resource):
+    """
+    Holds the cluster-wide lock on one resource, against other nodes and this
+    node's other threads. Lock managers that hand out fencing tokens (leases)
+    have theirs attached to every quorum write made inside the block.
+    """
+    token = RA.enter_CS(time=time.time() + caf_clock.CAF, ip_list=lock_ports(), resource=resource)
+    # Tokens are sent as strings: they are larger than XML-RPC's 32-bit integers.
+    lock_context.fence = None if token is None else {"resource": resource, "token": str(token)}
+    try:
+        yield
+    finally:
+        lock_context.fence = None
+        RA.exit_CS(resource=resource)
 
-# --- XML-RPC Client for Node-to-Node Communication ---
-def send_rpc_to_peer(node_address, rpc_message):
-    """Sends an RPC message to another data node (a peer) using XML-RPC."""
+def check_fence(cursor, fence):
+    """
+    Refuses a write whose fencing token is older than the newest one already
+    written under the same resource, so a holder whose lease expired while it
+    was paused cannot overwrite its successor's work. Records the token otherwise.
+    """
+    resource, token = fence["resource"], int(fence["token"])
+    row = cursor.execute("SELECT token FROM fences WHERE resource = ?", (resource,)).fetchone()
+    if row is not None and row[0] > token:
+        raise FencingError(f"Stale fencing token {token} for '{resource}': {row[0]} has already written")
+    cursor.execute("INSERT INTO fences (resource, token) VALUES (?, ?) "
+                   "ON CONFLICT (resource) DO UPDATE SET token = excluded.token WHERE excluded.token > fences.token",
+                   (resource, token))
+
+@contextmanager
+def snapshot_read(cursor):
+    """
+    Runs the block's SELECTs against a single WAL snapshot. Readers see one
+    consistent state of the database without waiting for, or blocking, writers.
+    """
+    conn = cursor.connection
+    if conn.in_transaction:
+        yield
+        return
+    cursor.execute("BEGIN")
+    try:
+        yield
+    finally:
+        conn.commit()
+
+def lock_ports():
+    """Lock daemon ports of the data nodes that are up, this one included."""
+    return [member["lock_port"] for member in membership.alive("data_node")]
+
+# --- Cluster Membership ---
+def data_node_peers(view):
+    """(host, port) of every other data node that has not left the cluster."""
+    return [(m["host"], m["port"]) for m in view.members("data_node") if m["id"] != view.id]
+
+def clock_peers():
+    """(host, clock port) of the data nodes that are up, this one first."""
+    me = membership.member()
+    return [(me["host"], me["clock_port"])] + [(m["host"], m["clock_port"]) for m in membership.alive("data_node")
+                                               if m["id"] != membership.id]
+
+def alive_data_nodes():
+    return [(m["host"], m["port"]) for m in membership.alive("data_node")]
+
+def on_membership_change(view):
+    global ring
+    peers = data_node_peers(view)
+    replication_engine.set_peers(peers)
+    hinted_handoff.set_peers(peers)
+    anti_entropy.set_peers(peers)
+    nodes = [(m["host"], m["port"]) for m in view.members("data_node")]
+    if set(nodes) != set(ring.nodes):
+        previous, ring = ring, HashRing(nodes)
+        print(f"[*] DataNode-{NODE_PORT}: Ring now has {len(ring.nodes)} data nodes")
+        threading.Thread(target=stream_takeovers, args=(previous,), daemon=True).start()
+
+# --- Sharding ---
+def is_empty():
+    conn = db_pool.connection()
+    return all(conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None for table in REPLICATED_TABLES)
+
+def shares(shard_key, peer):
+    """True when this node and peer both hold shard_key; scopes anti-entropy to the rows they have in common."""
+    owners = ring.owners(shard_key)
+    return NODE_ADDRESS in owners and tuple(peer) in owners
+
+def handle_shard_rows(cursor, data):
+    """
+    Returns the rows of a table whose patients fall in the requested ring arcs,
+    for a node that has taken those arcs over. Scans SHARD_SCAN_BATCH rows per
+    call in key order; the caller passes the returned 'after' key back until 'done'.
+    """
+    table = data.get("table")
+    if table not in REPLICATED_TABLES:
+        return {"status": "error", "code": 400, "error": f"Table '{table}' is not sharded"}
+    ranges = decode_ranges(data.get("ranges") or [])
+    key_column, shard_column = REPLICATED_TABLES[table], SHARD_COLUMNS[table]
+    cursor.execute(f"SELECT * FROM {table} WHERE {key_column} > ? ORDER BY {key_column} LIMIT ?",
+                   (data.get("after") or "", SHARD_SCAN_BATCH))
+    scanned = rows_as_dicts(cursor)
+    rows = [row for row in scanned if in_ranges(ring_hash(row[shard_column]), ranges)]
+    return {"status": "success", "rows": rows, "after": scanned[-1][key_column] if scanned else None,
+            "done": len(scanned) < SHARD_SCAN_BATCH}
+
+def stream_takeovers(previous):
+    """Pulls the rows of every arc this node owns on the current ring but not on previous from a former owner."""
+    sources = ring.takeovers(previous, NODE_ADDRESS, set(alive_data_nodes()))
+    conn = db_pool.connection()
+    cursor = conn.cursor()
+    try:
+        for source, ranges in sources.items():
+            for table in REPLICATED_TABLES:
+                streamed = 0
+                request = {"table": table, "ranges": encode_ranges(ranges), "after": ""}
+                while True:
+                    response = send_rpc_to_peer(source, {"action": "shard_rows", "data": request})
+                    if response.get("status") != "success":
+                        print(f"[WARNING] DataNode-{NODE_PORT}: Streaming '{table}' from {source} stopped: "
+                              f"{response.get('message') or response.get('error')}")
+                        break
+                    if response["rows"]:
+                        handle_replicate_write(cursor, {"record_type": BATCH_RECORD_TYPES[table], "record_data": response["rows"]})
+                        conn.commit()
+                        streamed += len(response["rows"])
+                    if response["done"]:
+                        break
+                    request["after"] = response["after"]
+                print(f"[*] DataNode-{NODE_PORT}: Took over {streamed} '{table}' rows in {len(ranges)} ranges from {source}")
+    finally:
+        cursor.close()
+
+# --- RPC Client for Node-to-Node Communication ---
+def peer_client(node_address):
+    with peer_clients_lock:
+        client = peer_clients.get(node_address)
+        if client is None:
+            client = peer_clients[node_address] = NodeRPCClient(node_address[0], node_address[1], RPC_PROTOCOL)
+        return client
+
+def send_rpc_to_peer(node_address, rpc_message, timeout=None):
+    """Sends an RPC message to another data node (a peer) over its persistent RPC client, waiting up to timeout seconds."""
     host, port = node_address
     action = rpc_message['action']
     data = rpc_message['data']
     
     print(f"[*] DataNode-{NODE_PORT}: Replicating action '{action}' to peer http://{host}:{port}")
     try:
-        proxy = xmlrpc.client.ServerProxy(f"http://{host}:{port}/", allow_none=True)
-        return proxy.dispatch_rpc(action, data)
-    except (ConnectionRefusedError, xmlrpc.client.ProtocolError):
+        return peer_client(node_address).call(action, data, timeout)
+    except (ConnectionError, xmlrpc.client.ProtocolError):
         return {"status": "error", "message": f"Peer {host}:{port} is offline."}
     except Exception as e:
         return {"status": "error", "message": f"RPC to peer error: {e}"}
 
-# --- Internal Replication Handler (No changes needed) ---
+def send_rpc_to_replica(node_address, rpc_message):
+    """A quorum round's call to one peer: it gives up with the round, so a stalled peer only costs REPLICATION_TIMEOUT."""
+    return send_rpc_to_peer(node_address, rpc_message, REPLICATION_TIMEOUT)
+
+# --- Internal Replication Handler ---
+# Replicated rows only overwrite an older version, so late, replayed or repaired writes never roll a row back.
+USER_UPSERT_SQL = '''INSERT INTO users (uuid, username, first_name, last_name, dob, password, version) VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (uuid) DO UPDATE SET username = excluded.username, first_name = excluded.first_name,
+    last_name = excluded.last_name, dob = excluded.dob, password = excluded.password, version = excluded.version
+    WHERE excluded.version > users.version'''
+RECORD_INSERT_SQL = '''INSERT INTO records (record_id, patient_uuid, doctor_name, description, resources_used, prescription, timestamp, version) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (record_id) DO UPDATE SET patient_uuid = excluded.patient_uuid, doctor_name = excluded.doctor_name,
+    description = excluded.description, resources_used = excluded.resources_used, prescription = excluded.prescription,
+    timestamp = excluded.timestamp, version = excluded.version
+    WHERE excluded.version > records.version'''
+USERNAME_UPSERT_SQL = '''INSERT INTO usernames (username, uuid, version) VALUES (?, ?, ?)
+    ON CONFLICT (username) DO UPDATE SET uuid = excluded.uuid, version = excluded.version
+    WHERE excluded.version > usernames.version'''
+
+def user_row(user_data):
+    return (user_data['uuid'], user_data['username'], user_data['first_name'], user_data['last_name'], user_data['dob'], user_data['password'], user_data.get('version', 0))
+
+def record_row(record_data):
+    return (record_data['record_id'], record_data['patient_uuid'], record_data['doctor_name'], record_data['description'], record_data.get('resources_used'), record_data['prescription'], record_data['timestamp'], record_data.get('version', 0))
+
+def username_row(entry):
+    return (entry['username'], entry['uuid'], entry.get('version', 0))
+
 def handle_replicate_write(cursor, data):
     """Handles a write request from a peer node, updated for the new schema."""
     record_type = data.get("record_type")
     print(f"[*] DataNode-{NODE_PORT}: Received replication request for type '{record_type}'")
     record_data = data.get("record_data")
+    if data.get("fence"):
+        check_fence(cursor, data["fence"])
     if record_type == "user":
-        cursor.execute(
-            "INSERT OR REPLACE INTO users (uuid, username, first_name, last_name, dob, password) VALUES (?, ?, ?, ?, ?, ?)",
-            (record_data['uuid'], record_data['username'], record_data['first_name'], record_data['last_name'], record_data['dob'], record_data['password'])
-        )
+        cursor.execute(USER_UPSERT_SQL, user_row(record_data))
+    elif record_type == "user_batch":
+        cursor.executemany(USER_UPSERT_SQL, [user_row(user) for user in record_data])
     elif record_type == "record":
-        cursor.execute(
-            "INSERT OR REPLACE INTO records (record_id, patient_uuid, doctor_name, description, resources_used, prescription, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (record_data['record_id'], record_data['patient_uuid'], record_data['doctor_name'], record_data['description'], record_data.get('resources_used'), record_data['prescription'], record_data['timestamp'])
-        )
+        cursor.execute(RECORD_INSERT_SQL, record_row(record_data))
+    elif record_type == "record_batch":
+        # record_data is a list of records, written in the caller's single transaction.
+        cursor.executemany(RECORD_INSERT_SQL, [record_row(record) for record in record_data])
+    elif record_type == "username":
+        cursor.execute(USERNAME_UPSERT_SQL, username_row(record_data))
+    elif record_type == "username_batch":
+        cursor.executemany(USERNAME_UPSERT_SQL, [username_row(entry) for entry in record_data])
     else:
         return {"status": "error", "message": "Unknown record type for replication"}
     return {"status": "success", "message": "Replication successful"}
 
-# --- Quorum Write Helper (No changes needed) ---
-def perform_quorum_write(cursor, record_type, record_data):
-    handle_replicate_write(cursor, {"record_type": record_type, "record_data": record_data})
-    
-    replication_payload = {
-        "action": "replicate_write",
-        "data": {"record_type": record_type, "record_data": record_data}
-    }
-    peers = [p for p in DATA_NODE_PEERS if p[1] != NODE_PORT]
-    
-    ack_count = 1
-    ack_lock = threading.Lock()
-    
-    def replicate_and_count(peer):
-        nonlocal ack_count
-        response = send_rpc_to_peer(peer, replication_payload)
-        if response and response.get("status") == "success":
-            with ack_lock:
-                ack_count += 1
+def handle_replicate_write_batch(cursor, data):
+    """
+    Applies a backlog of replicate_write payloads from a peer's hinted handoff in
+    one transaction, each write under its own savepoint. A write that can never
+    apply (a stale fence, a constraint it breaks, a malformed payload) is rolled
+    back and dropped, since the peer would resend it forever; any other error
+    fails the batch, and the peer retries it later.
+    """
+    writes = data.get("writes") or []
+    print(f"[*] DataNode-{NODE_PORT}: Received {len(writes)} missed writes from hinted handoff")
+    applied = 0
+    for write in writes:
+        cursor.execute("SAVEPOINT missed_write")
+        try:
+            response = handle_replicate_write(cursor, write)
+            if response.get("status") != "success":
+                raise ValueError(response.get("message"))
+        except (FencingError, sqlite3.IntegrityError, ValueError, KeyError, TypeError) as e:
+            cursor.execute("ROLLBACK TO missed_write")
+            print(f"[WARNING] DataNode-{NODE_PORT}: Dropping missed write: {e}")
+        else:
+            applied += 1
+        cursor.execute("RELEASE missed_write")
+    return {"status": "success", "message": f"Applied {applied} of {len(writes)} writes"}
 
-    with ThreadPoolExecutor(max_workers=len(peers)) as executor:
-        executor.map(replicate_and_count, peers)
+# --- Quorum Write Helper ---
+def perform_quorum_write(cursor, record_type, record_data, shard_key):
+    """
+    Writes locally when this node is one of shard_key's replicas, then returns
+    once QUORUM_W of them hold the write. Inside a fenced critical section every
+    replica checks the lease's token; a stale one raises FencingError here or is
+    refused by the peers.
+    """
+    write = {"record_type": record_type, "record_data": record_data}
+    fence = getattr(lock_context, "fence", None)
+    if fence is not None:
+        write["fence"] = fence
+    replicas = ring.owners(shard_key)
+    if NODE_ADDRESS in replicas:
+        handle_replicate_write(cursor, write)
+        # Release SQLite's write lock before waiting on the peers, so other writers on
+        # this node, and replicated writes arriving from peers, are not stuck behind it.
+        cursor.connection.commit()
 
-    return ack_count >= QUORUM_W, ack_count
+    replication_payload = {"action": "replicate_write", "data": write}
+    return replication_engine.replicate(replication_payload, local_acks=int(NODE_ADDRESS in replicas),
+                                        peers=[node for node in replicas if node != NODE_ADDRESS])
 
 # --- External Action Handlers (No changes needed) ---
 def handle_add_account(cursor, data):
     print(f"[*] DataNode-{NODE_PORT}: Handling 'add_account' for user '{data.get('username')}'")
-    user_uuid = str(uuid.uuid4())
+    user_uuid = lookup_uuid(cursor, data['username'])
+    if isinstance(user_uuid, dict):
+        return user_uuid
+    if user_uuid is None:
+        user_uuid = str(uuid.uuid4())
+    else:
+        # An entry without a user row is left by an attempt whose user write failed; finish it under the same uuid.
+        existing, answered = quorum_read(cursor, "get_data", {"uuid": user_uuid, "limit": 1}, user_uuid)
+        if existing is None:
+            return read_quorum_error(answered)
+        if existing["users"]:
+            return {"status": "error", "code": 409, "error": "Username already exists"}
+    version = (time.time() + caf_clock.CAF) * 1000
     user_data = {
         'uuid': user_uuid, 'username': data['username'], 'first_name': data['first_name'],
-        'last_name': data['last_name'], 'dob': data['dob'], 'password': data['password']
+        'last_name': data['last_name'], 'dob': data['dob'], 'password': data['password'],
+        'version': version
     }
-    success, acks = perform_quorum_write(cursor, "user", user_data)
+    # The username is claimed first, so a retry after a failed user write reuses the uuid
+    # instead of leaving a second user row with the same username behind.
+    success, acks = perform_quorum_write(cursor, "username", {'username': data['username'], 'uuid': user_uuid, 'version': version}, data['username'])
+    if success:
+        success, acks = perform_quorum_write(cursor, "user", user_data, user_uuid)
     if success:
         print(f"[SUCCESS] DataNode-{NODE_PORT}: Account for '{data.get('username')}' replicated with {acks} acks.")
         return {"status": "success", "code": 201, "message": "Account created", "uuid": user_uuid}
@@ -131,10 +525,10 @@ def handle_add_record(cursor, data):
     new_record = {
         "record_id": record_id, "patient_uuid": data['patient_uuid'], "doctor_name": data['doctor_name'], 
         "description": data['description'], "resources_used": data.get('resources_used'), "prescription": data['prescription'],
-        "timestamp": synchronized_time 
+        "timestamp": synchronized_time, "version": synchronized_time
     }
     
-    success, acks = perform_quorum_write(cursor, "record", new_record)
+    success, acks = perform_quorum_write(cursor, "record", new_record, new_record['patient_uuid'])
     if success:
         print(f"[SUCCESS] DataNode-{NODE_PORT}: Record for patient '{data.get('patient_uuid')}' replicated with {acks} acks.")
         return {"status": "success", "code": 201, "message": f"Record added and replicated to {acks} nodes.", "record_id": record_id}
@@ -142,107 +536,443 @@ def handle_add_record(cursor, data):
         print(f"[FAILURE] DataNode-{NODE_PORT}: Quorum failed for 'add_record' ({acks}/{QUORUM_W})")
         return {"status": "error", "code": 500, "error": f"Quorum failed. Only {acks}/{QUORUM_W} nodes acknowledged."}
 
+def handle_add_records_batch(cursor, data):
+    """
+    Inserts many records and replicates them in one replicate_write round per
+    replica set. Returns an outcome for every input row.
+    """
+    global caf_clock
+    records = data.get('records') or []
+    print(f"[*] DataNode-{NODE_PORT}: Handling 'add_records_batch' with {len(records)} records")
+    if len(records) > MAX_BATCH_SIZE:
+        return {"status": "error", "code": 413, "error": f"Batch of {len(records)} exceeds the limit of {MAX_BATCH_SIZE} records."}
+
+    base_time = (time.time() + caf_clock.CAF) * 1000
+    results = []
+    new_records = []
+    for index, record in enumerate(records):
+        record = record if isinstance(record, dict) else {}
+        missing = [field for field in ('patient_uuid', 'doctor_name', 'description', 'prescription') if not record.get(field)]
+        if missing:
+            results.append({"index": index, "status": "error", "error": f"Missing fields: {', '.join(missing)}"})
+            continue
+        new_record = {
+            "record_id": str(uuid.uuid4()), "patient_uuid": record['patient_uuid'], "doctor_name": record['doctor_name'],
+            "description": record['description'], "resources_used": record.get('resources_used'), "prescription": record['prescription'],
+            # Distinct timestamps keep a batch's records in the order they were sent.
+            "timestamp": base_time + len(new_records) * 0.001, "version": base_time
+        }
+        new_records.append(new_record)
+        results.append({"index": index, "status": "success", "record_id": new_record['record_id'], "patient_uuid": new_record['patient_uuid']})
+
+    if not new_records:
+        return {"status": "error", "code": 400, "error": "No valid records in batch", "results": results}
+
+    groups = {}
+    for new_record in new_records:
+        groups.setdefault(tuple(ring.owners(new_record['patient_uuid'])), []).append(new_record)
+    quorum_errors = {}
+    min_acks = None
+    for group in groups.values():
+        success, acks = perform_quorum_write(cursor, "record_batch", group, group[0]['patient_uuid'])
+        min_acks = acks if min_acks is None else min(min_acks, acks)
+        if not success:
+            print(f"[FAILURE] DataNode-{NODE_PORT}: Quorum failed for {len(group)} records of 'add_records_batch' ({acks}/{QUORUM_W})")
+            quorum_errors.update((record['record_id'], f"Quorum failed. Only {acks}/{QUORUM_W} nodes acknowledged.")
+                                 for record in group)
+    for result in results:
+        if result.get('record_id') in quorum_errors:
+            result.update({"status": "error", "error": quorum_errors[result['record_id']]})
+            del result['record_id']
+
+    inserted = len(new_records) - len(quorum_errors)
+    if not inserted:
+        return {"status": "error", "code": 500, "error": next(iter(quorum_errors.values())), "results": results}
+    failed = len(records) - inserted
+    print(f"[SUCCESS] DataNode-{NODE_PORT}: Batch of {inserted} records replicated with at least {min_acks} acks.")
+    return {"status": "success" if not failed else "partial", "code": 201 if not failed else 207,
+            "message": f"{inserted} records added and replicated to at least {min_acks} nodes.",
+            "inserted": inserted, "failed": failed, "results": results}
+
+def page_limit(data):
+    """The page size a read asked for, clamped to MAX_PAGE_SIZE, or None for the whole history."""
+    limit = data.get('limit')
+    return None if limit is None else max(1, min(int(limit), MAX_PAGE_SIZE))
+
+def rows_as_dicts(cursor):
+    columns = [desc[0] for desc in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def fetch_records_rows(cursor, patient_uuid, data):
+    """
+    Reads a patient's records, newest first, using a keyset cursor.
+
+    data may carry 'limit', and 'before_timestamp' and 'before_record_id' (the
+    timestamp and id of the last record on the previous page; a cursor without
+    the id, from an older client, only compares timestamps). Without 'limit' the
+    whole history is returned. With it, one extra row is read so cut_page can
+    tell whether another page exists without a COUNT(*).
+    """
+    limit = page_limit(data)
+    before_timestamp, before_record_id = data.get('before_timestamp'), data.get('before_record_id')
+    query = "SELECT * FROM records WHERE patient_uuid = ?"
+    params = [patient_uuid]
+    if before_timestamp is not None and before_record_id is not None:
+        query += " AND (timestamp, record_id) < (?, ?)"
+        params += [before_timestamp, before_record_id]
+    elif before_timestamp is not None:
+        query += " AND timestamp < ?"
+        params.append(before_timestamp)
+    query += " ORDER BY timestamp DESC, record_id DESC"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit + 1)
+    cursor.execute(query, params)
+    return rows_as_dicts(cursor)
+
+def cut_page(records, data):
+    """
+    Trims newest-first records to one page. Returns (records_list, cursor), where
+    cursor holds the next page's 'next_before_timestamp' and 'next_before_record_id',
+    both None on the last page.
+    """
+    limit = page_limit(data)
+    if limit is None or len(records) <= limit:
+        return records, {"next_before_timestamp": None, "next_before_record_id": None}
+    records = records[:limit]
+    return records, {"next_before_timestamp": records[-1]['timestamp'], "next_before_record_id": records[-1]['record_id']}
+
+# --- Quorum Reads ---
+# A replica read returns row dicts, each with its version, under "users" and
+# "records". The coordinator runs it locally and on every peer, answers once
+# QUORUM_R replicas agree, and builds the reply from the newest copy of each row.
+def read_user_data(cursor, data):
+    cursor.execute("SELECT * FROM users WHERE uuid = ?", (data.get('uuid'),))
+    users = rows_as_dicts(cursor)
+    records = []
+    for user in users:
+        records += fetch_records_rows(cursor, user['uuid'], data)
+    return {"users": users, "records": records}
+
+def read_patient_records(cursor, data):
+    return {"users": [], "records": fetch_records_rows(cursor, data.get('uuid'), data)}
+
+def read_username(cursor, data):
+    cursor.execute("SELECT * FROM usernames WHERE username = ?", (data.get('username'),))
+    return {"users": [], "records": [], "usernames": rows_as_dicts(cursor)}
+
+def read_patients(cursor, data):
+    """
+    Patients in (first_name, last_name, uuid) order, read straight off idx_users_listing.
+
+    data may carry 'name_prefix' (matched against "first_name last_name"),
+    'after' (the [first_name, last_name, uuid] of the last patient already
+    seen) and 'limit'.
+    """
+    query = "SELECT uuid, first_name, last_name, dob, version FROM users"
+    clauses, params = [], []
+    first_prefix, space, last_prefix = (data.get('name_prefix') or "").partition(" ")
+    if space:
+        clauses.append("first_name = ?")
+        params.append(first_prefix)
+    if last_prefix or (first_prefix and not space):
+        column, prefix = ("last_name", last_prefix) if space else ("first_name", first_prefix)
+        clauses.append(f"{column} >= ? AND {column} < ?")
+        params += [prefix, prefix_upper_bound(prefix)]
+    if data.get('after'):
+        clauses.append("(first_name, last_name, uuid) > (?, ?, ?)")
+        params += list(data['after'])
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += " ORDER BY first_name, last_name, uuid"
+    limit = page_limit(data)
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    cursor.execute(query, params)
+    return {"users": rows_as_dicts(cursor), "records": []}
+
+REPLICA_READS = {
+    "get_data": read_user_data, "get_records_by_uuid": read_patient_records, "lookup_username": read_username,
+}
+
+def handle_read_replica(cursor, data):
+    """Runs one of REPLICA_READS against this node only, for a peer that is coordinating a quorum read."""
+    read = REPLICA_READS.get(data.get('read'))
+    if read is None:
+        return {"status": "error", "code": 400, "error": f"Unknown replica read '{data.get('read')}'"}
+    return {"status": "success", **read(cursor, data.get('data') or {})}
+
+def replica_digest(response):
+    """Identifies a replica's answer by the keys and versions it returned."""
+    versions = sorted((table, row[key], row['version']) for table, key in REPLICATED_TABLES.items() for row in response.get(table, []))
+    return hashlib.sha1(json.dumps(versions).encode()).hexdigest()
+
+def merge_replica_reads(responses):
+    """Keeps the newest version of every row that any replica returned."""
+    merged = {}
+    for table, key in REPLICATED_TABLES.items():
+        newest = {}
+        for response in responses:
+            for row in response.get(table, []):
+                current = newest.get(row[key])
+                if current is None or row['version'] > current['version']:
+                    newest[row[key]] = row
+        merged[table] = list(newest.values())
+    merged["records"].sort(key=lambda row: (row['timestamp'], row['record_id']), reverse=True)
+    return merged
+
+def call_replica(replica, action, data):
+    """Calls an action on a peer, or on this node when replica is None."""
+    if replica is None:
+        return dispatch_rpc(action, data)
+    return send_rpc_to_peer(replica, {"action": action, "data": data})
+
+def covered_from(replies, data):
+    """
+    The (timestamp, record_id) from which every replica's answer to a paged read
+    is complete, or None when all of them are. A replica whose page filled up
+    (fetch_records_rows reads limit + 1 rows) may hold older records it did not return.
+    """
+    limit = page_limit(data)
+    if limit is None:
+        return None
+    cuts = [min((row['timestamp'], row['record_id']) for row in response["records"])
+            for response in replies.values() if len(response.get("records", [])) > limit]
+    return max(cuts) if cuts else None
+
+def read_repair(result, replies, data):
+    """
+    Sends the newest version of each row in result to every replica that answered
+    with an older copy or none. For a paged read only the records that every
+    replica's page covered are compared; past that a missing row is just off the page.
+    """
+    covered = covered_from(replies, data)
+    for table, key in REPLICATED_TABLES.items():
+        rows = result[table]
+        if table == "records" and covered is not None:
+            rows = [row for row in rows if (row['timestamp'], row['record_id']) >= covered]
+        newest = {row[key]: row['version'] for row in rows}
+        seen = {replica: {row[key]: row['version'] for row in response.get(table, [])} for replica, response in replies.items()}
+        stale = {replica: [k for k, version in newest.items() if versions.get(k, -1) < version] for replica, versions in seen.items()}
+        if not any(stale.values()):
+            continue
+        # Reads may carry only some columns, so fetch full rows from a replica that holds the newest copy.
+        wanted = {}
+        for k in set().union(*stale.values()):
+            source = next(replica for replica, versions in seen.items() if versions.get(k) == newest[k])
+            wanted.setdefault(source, []).append(k)
+        rows = {}
+        for source, keys in wanted.items():
+            response = call_replica(source, "merkle_rows", {"table": table, "keys": keys})
+            if response.get("status") == "success":
+                rows.update((row[key], row) for row in (dict(zip(response["columns"], values)) for values in response["rows"]))
+        for replica, keys in stale.items():
+            repairs = [rows[k] for k in keys if k in rows]
+            if repairs:
+                call_replica(replica, "replicate_write", {"record_type": BATCH_RECORD_TYPES[table], "record_data": repairs})
+                print(f"[*] DataNode-{NODE_PORT}: Read repair sent {len(repairs)} '{table}' rows to {'this node' if replica is None else replica}")
+
+def quorum_read(cursor, read_name, data, shard_key):
+    """
+    Runs a replica read on shard_key's replicas in parallel, this node included
+    when it is one, and returns as soon as QUORUM_R replicas agree. Returns
+    (result, answered); result is None when fewer than QUORUM_R replicas answered in time.
+    """
+    replicas = ring.owners(shard_key)
+    local = {"status": "success", **REPLICA_READS[read_name](cursor, data)} if NODE_ADDRESS in replicas else None
+    message = {"action": "read_replica", "data": {"read": read_name, "data": data}}
+    peers = [node for node in replicas if node != NODE_ADDRESS]
+    agreed, replies = replication_engine.read(message, local, QUORUM_R, replica_digest, peers)
+    if agreed is None and len(replies) < QUORUM_R:
+        return None, len(replies)
+    result = merge_replica_reads(replies.values())
+    replication_engine.executor.submit(read_repair, result, replies, data)
+    return result, len(replies)
+
+def read_quorum_error(answered):
+    print(f"[FAILURE] DataNode-{NODE_PORT}: Read quorum failed ({answered}/{QUORUM_R})")
+    return {"status": "error", "code": 503, "error": f"Read quorum failed. Only {answered}/{QUORUM_R} nodes answered."}
+
+def lookup_uuid(cursor, username):
+    """The uuid the usernames directory maps username to, None if it has no entry, or an error response."""
+    result, answered = quorum_read(cursor, "lookup_username", {"username": username}, username)
+    if result is None:
+        return read_quorum_error(answered)
+    if not result["usernames"]:
+        return None
+    return max(result["usernames"], key=lambda entry: entry['version'])['uuid']
+
 def handle_get_data(cursor, data):
-    global RA
     print(f"[*] DataNode-{NODE_PORT}: Handling 'get_data' for user '{data.get('username')}'")
-    RA.enter_CS(time=time.time() + caf_clock.CAF)
-    cursor.execute("SELECT * FROM users WHERE username = ?", (data.get('username'),))
-    user_row = cursor.fetchone()
-    RA.exit_CS()
-    if user_row is None:
+    user_uuid = lookup_uuid(cursor, data.get('username') or "")
+    if isinstance(user_uuid, dict):
+        return user_uuid
+    if user_uuid is None:
+        return {"status": "error", "code": 404, "error": "User not found"}
+    result, answered = quorum_read(cursor, "get_data", {**data, "uuid": user_uuid}, user_uuid)
+    if result is None:
+        return read_quorum_error(answered)
+    if not result["users"]:
         return {"status": "error", "code": 404, "error": "User not found"}
-    user_columns = [desc[0] for desc in cursor.description]
-    user_data = dict(zip(user_columns, user_row))
+    user_data = max(result["users"], key=lambda user: user['version'])
     if user_data.get('password') != data.get('password'):
         return {"status": "error", "code": 401, "error": "Authentication failed"}
     del user_data['password']
-    
-    RA.enter_CS(time=time.time() + caf_clock.CAF)
-    cursor.execute("SELECT * FROM records WHERE patient_uuid = ? ORDER BY timestamp DESC", (user_data['uuid'],))
-    record_rows = cursor.fetchall()
-    RA.exit_CS()
-    record_columns = [desc[0] for desc in cursor.description]
-    records_list = [dict(zip(record_columns, row)) for row in record_rows]
-    return {"status": "success", "code": 200, "data": {"user_info": user_data, "records": records_list}}
+
+    records = [record for record in result["records"] if record['patient_uuid'] == user_data['uuid']]
+    records_list, cursor = cut_page(records, data)
+    return {"status": "success", "code": 200, "data": {"user_info": user_data, "records": records_list}, **cursor}
 
 def handle_get_records_by_uuid(cursor, data):
     print(f"[*] DataNode-{NODE_PORT}: Handling 'get_records_by_uuid' for patient UUID '{data.get('uuid')}'")
-    patient_uuid = data.get('uuid')
-    RA.enter_CS(time=time.time() + caf_clock.CAF)
-    cursor.execute("SELECT * FROM records WHERE patient_uuid = ? ORDER BY timestamp DESC", (patient_uuid,))
-    record_rows = cursor.fetchall()
-    RA.exit_CS()
-    if not record_rows:
-        return {"status": "success", "code": 200, "data": []}
-    record_columns = [desc[0] for desc in cursor.description]
-    records_list = [dict(zip(record_columns, row)) for row in record_rows]
-    return {"status": "success", "code": 200, "data": records_list}
-
-def get_all_patients_legacy(cursor, data):
-    global caf_clock
-    print(f"[*] DataNode-{NODE_PORT}: Handling LEGACY 'get_all_patients'")
-    RA.enter_CS(time=time.time() + caf_clock.CAF)
-    cursor.execute("SELECT uuid, first_name, last_name, dob FROM users")
-    rows = cursor.fetchall()
-    RA.exit_CS()
-    patients = {row[0]: {"patient_id": row[0], "name": f"{row[1]} {row[2]}", "dob": row[3]} for row in rows}
-    return {"status": "success", "data": patients}
+    result, answered = quorum_read(cursor, "get_records_by_uuid", data, data.get('uuid'))
+    if result is None:
+        return read_quorum_error(answered)
+    records_list, cursor = cut_page(result["records"], data)
+    return {"status": "success", "code": 200, "data": records_list, **cursor}
+
+def handle_list_patients(cursor, data):
+    """
+    This node's own patients, one sorted page of them. Every node holds a
+    different share, so the app node asks each of them and merges the pages;
+    see scatter_gather.py.
+    """
+    print(f"[*] DataNode-{NODE_PORT}: Handling 'list_patients' (prefix '{data.get('name_prefix') or ''}', limit {data.get('limit')})")
+    return {"status": "success", "patients": read_patients(cursor, data)["users"]}
+
+# --- Anti-Entropy Handlers ---
+def handle_merkle_digests(cursor, data):
+    return anti_entropy.handle_digests(cursor, data)
+
+def handle_merkle_keys(cursor, data):
+    return anti_entropy.handle_keys(cursor, data)
+
+def handle_merkle_rows(cursor, data):
+    return anti_entropy.handle_rows(cursor, data)
 
 # Mapping actions to functions
 ACTION_MAP = {
     "add_account": handle_add_account, "add_record": handle_add_record,
+    "add_records_batch": handle_add_records_batch,
     "get_data": handle_get_data, "get_records_by_uuid": handle_get_records_by_uuid,
-    "replicate_write": handle_replicate_write, "get_all_patients": get_all_patients_legacy,
+    "replicate_write": handle_replicate_write, "replicate_write_batch": handle_replicate_write_batch,
+    "read_replica": handle_read_replica,
+    "list_patients": handle_list_patients,
+    "merkle_digests": handle_merkle_digests, "merkle_keys": handle_merkle_keys, "merkle_rows": handle_merkle_rows,
+    "shard_rows": handle_shard_rows,
+}
+
+# How each action is isolated from concurrent work:
+#   "snapshot"    - reads run on one WAL snapshot; row versions and quorum reads handle replica lag
+#   "local"       - SQLite's write lock serializes writers on this node; replicas keep the newest version
+#   "distributed" - the whole handler holds the cluster-wide LOCK_BACKEND lock on the
+#                   resource named by LOCK_RESOURCES, so work on other resources runs in parallel
+# Actions not listed run as "local".
+ACTION_LOCK_POLICY = {
+    "get_data": "snapshot", "get_records_by_uuid": "snapshot", "list_patients": "snapshot",
+    "read_replica": "snapshot", "merkle_keys": "snapshot", "merkle_rows": "snapshot", "shard_rows": "snapshot",
+    # A username is checked and claimed in one step, which must not interleave across nodes.
+    "add_account": "distributed",
 }
 
-# --- XML-RPC Dispatcher ---
+# The lock key a "distributed" action takes, derived from its request data.
+LOCK_RESOURCES = {
+    "add_account": lambda data: f"username:{data.get('username')}",
+}
+
+def action_isolation(action, cursor, data):
+    """Returns the context manager that isolates action according to ACTION_LOCK_POLICY."""
+    policy = ACTION_LOCK_POLICY.get(action, "local")
+    if policy == "snapshot":
+        return snapshot_read(cursor)
+    if policy == "distributed":
+        resource = LOCK_RESOURCES.get(action, lambda data: "global")(data)
+        return critical_section(resource)
+    return nullcontext()
+
+# --- RPC Dispatcher ---
 def dispatch_rpc(action, data):
-    """Main dispatcher for all incoming XML-RPC calls."""
-    print(f"\n--- DataNode-{NODE_PORT}: Received XML-RPC call for action: '{action}' ---")
+    """Main dispatcher for all incoming RPC calls, over XML-RPC or the binary transport."""
+    print(f"\n--- DataNode-{NODE_PORT}: Received RPC call for action: '{action}' ---")
     
     response = {"status": "error", "code": 400, "message": "Unknown action"}
     if action not in ACTION_MAP:
         return response
 
-    conn = sqlite3.connect(DB_NAME_GLOBAL, check_same_thread=False)
+    conn = db_pool.connection()
     cursor = conn.cursor()
     try:
-        response = ACTION_MAP[action](cursor, data)
+        with action_isolation(action, cursor, data):
+            response = ACTION_MAP[action](cursor, data)
         conn.commit()
     except sqlite3.IntegrityError:
         conn.rollback()
         response = {"status": "error", "code": 409, "error": "Username already exists or constraint failed"}
+    except FencingError as e:
+        conn.rollback()
+        response = {"status": "error", "code": 409, "error": str(e)}
+        print(f"[FAILURE] DataNode-{NODE_PORT}: {e}")
     except Exception as e:
         conn.rollback()
         response = {"status": "error", "code": 500, "message": f"An internal error occurred: {e}"}
         print(f"[ERROR] Exception during action '{action}': {e}")
     finally:
-        conn.close()
+        cursor.close()
         
     return response
 
+def rpc_capabilities():
+    """Tells clients which transports this node serves, so they can switch to binary RPC."""
+    if BINARY_RPC_ENABLED and binary_rpc.is_available():
+        return {"protocols": ["xmlrpc", "binary"], "binary_port": NODE_PORT + binary_rpc.BINARY_PORT_OFFSET}
+    return {"protocols": ["xmlrpc"]}
+
 # --- Main Server Function ---
-def main(port, db_name):
-    global NODE_PORT, caf_clock, RA, DB_NAME_GLOBAL
+def main(port, db_name, host='127.0.0.1'):
+    global NODE_PORT, caf_clock, RA, DB_NAME_GLOBAL, db_pool, replication_engine, hinted_handoff, anti_entropy, membership
+    global NODE_ADDRESS, ring
     NODE_PORT = port
+    NODE_ADDRESS = (host, port)
     DB_NAME_GLOBAL = db_name
+    membership = Membership("data_node", host, port)
+    me = membership.member()
     
-    # Initialize CAF and Ricart-Agrawala services
-    caf_port = port - 3000
-    RA_port = port - 4000
-    caf_clock = CAF_Clock(caf_port)
-    RA = RicAgra(RA_port)
-    print(f"CAF Clock synchronization service started on port {caf_port}")
+    # Initialize CAF and the distributed lock manager
+    caf_clock = CAF_Clock(me["clock_port"], peers=clock_peers)
+    RA = LOCK_BACKENDS[LOCK_BACKEND](me["lock_port"])
+    print(f"CAF Clock synchronization service started on port {me['clock_port']}")
     
     init_db(db_name)
-    host = '127.0.0.1'
+    db_pool = SQLiteConnectionPool(db_name, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE_KB, SQLITE_BUSY_TIMEOUT)
+    peers = data_node_peers(membership)
+    ring = HashRing([(m["host"], m["port"]) for m in membership.members("data_node")])
+    hinted_handoff = HintedHandoff(f"{db_name}.hints", peers, send_rpc_to_peer)
+    replication_engine = ReplicationEngine(peers, send_rpc_to_replica, QUORUM_W, timeout=REPLICATION_TIMEOUT,
+                                           on_failure=hinted_handoff.store)
+    anti_entropy = AntiEntropy(db_pool, REPLICATED_TABLES, peers, send_rpc_to_peer, interval=ANTI_ENTROPY_INTERVAL,
+                               version_column="version", node=NODE_ADDRESS, shard_columns=SHARD_COLUMNS, shares=shares)
+    anti_entropy.start()
+    membership.add_listener(on_membership_change)
+    if is_empty() and len(ring.nodes) > 1:
+        # A new node starts with nothing: pull its ranges as if it had just joined the rest of the ring.
+        threading.Thread(target=stream_takeovers, args=(HashRing([n for n in ring.nodes if n != NODE_ADDRESS]),),
+                         daemon=True).start()
+
+    # Serve the binary protocol alongside XML-RPC; both feed the same dispatcher.
+    if BINARY_RPC_ENABLED and binary_rpc.is_available():
+        binary_port = port + binary_rpc.BINARY_PORT_OFFSET
+        binary_server = binary_rpc.BinaryRPCServer((host, binary_port), dispatch_rpc, SERVER_WORKERS, MAX_QUEUE_DEPTH)
+        threading.Thread(target=binary_server.serve_forever, daemon=True).start()
+        print(f"Data Node binary RPC server is listening on {host}:{binary_port}")
     
     # Setup and run the XML-RPC server
-    with SimpleXMLRPCServer((host, port), allow_none=True) as server:
+    with PooledXMLRPCServer((host, port), requestHandler=KeepAliveRequestHandler, allow_none=True) as server:
         server.register_introspection_functions()
         
         # Register the single dispatcher function to handle all requests
         server.register_function(dispatch_rpc, 'dispatch_rpc')
+        server.register_function(rpc_capabilities, 'rpc_capabilities')
         
         print(f"Data Node XML-RPC server is listening on {host}:{port}, using database '{db_name}'")
         server.serve_forever()
@@ -0,0 +1,176 @@
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from membership import Membership, load_cluster_config
+
+# Shared by both gateway engines, api_gateway.py (Flask) and async_gateway.py
+# (asyncio), so however the gateway is started it has one balancer, and it is
+# the one that membership keeps up to date.
+
+# --- Configuration ---
+# The Application Nodes are listed in cluster.json. Once the gateway joins the
+# cluster, the balancer follows the ones that membership reports as up.
+GATEWAY_HOST = '127.0.0.1'
+GATEWAY_PORT = 5000           # What the frontend expects
+APP_NODE_URLS = [f"http://{node['host']}:{node['port']}" for node in load_cluster_config()["app_node"]]
+
+# --- Connection Pool Configuration ---
+POOL_MAXSIZE_PER_NODE = 20   # Max keep-alive connections held open to each app node
+STREAM_CHUNK_SIZE = 64 * 1024
+UPSTREAM_TIMEOUT = 5         # Seconds, used for both connect and read
+
+# --- Load Balancer Configuration ---
+BALANCER_STRATEGY = "p2c"     # "p2c" (power of two choices) or "least_outstanding"
+EWMA_ALPHA = 0.3              # Weight given to the newest latency sample
+EJECT_AFTER_FAILURES = 3      # Consecutive failures before a node is taken out of rotation
+HEALTH_CHECK_INTERVAL = 2     # Seconds between probes of ejected nodes
+HEALTH_CHECK_PATH = "/health"
+# Idempotent methods; a request with one of them and no body is retried on another node after a connect failure.
+RETRY_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+# Upstream statuses that count against the app node itself. An app node answers 503
+# when a data node behind it is down, which says nothing about the app node.
+NODE_FAILURE_STATUSES = {502, 504}
+
+# Hop-by-hop headers apply to a single connection and must not be forwarded.
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade', 'host',
+}
+
+# --- Pooled Sessions ---
+def create_node_session(pool_maxsize=POOL_MAXSIZE_PER_NODE):
+    """Builds a keep-alive session whose pool is bounded to pool_maxsize connections."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, pool_block=True, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# One session per app node, so every node gets its own bounded connection pool.
+node_sessions = {}
+node_sessions_lock = threading.Lock()
+
+def node_session(node_url):
+    with node_sessions_lock:
+        session = node_sessions.get(node_url)
+        if session is None:
+            session = node_sessions[node_url] = create_node_session()
+        return session
+
+# --- Health-Aware Load Balancer ---
+class Backend:
+    """Live load and health statistics for a single Application Node."""
+    def __init__(self, url, ewma_latency=0.0):
+        self.url = url
+        self.in_flight = 0
+        self.ewma_latency = ewma_latency
+        self.consecutive_failures = 0
+        self.healthy = True
+
+    def score(self):
+        # Expected wait for a new request: queue length times the typical service time.
+        return (self.in_flight + 1) * (self.ewma_latency or 0.001)
+
+
+class LoadBalancer:
+    """
+    Picks the least-loaded healthy Application Node, using in-flight request
+    counts and EWMA latency. Nodes that fail repeatedly are ejected and
+    probed in the background until they answer again.
+    """
+    def __init__(self, urls, strategy=BALANCER_STRATEGY):
+        self.backends = [Backend(url) for url in urls]
+        self.strategy = strategy
+        self.lock = threading.Lock()
+        prober = threading.Thread(target=self.health_check_daemon, daemon=True)
+        prober.start()
+
+    def acquire(self, exclude=()):
+        """Chooses a backend and counts the request against it. Returns None if none are available."""
+        with self.lock:
+            candidates = [b for b in self.backends if b.healthy and b.url not in exclude]
+            if not candidates:
+                # Every node is ejected: fall back to trying any node rather than failing outright.
+                candidates = [b for b in self.backends if b.url not in exclude]
+            if not candidates:
+                return None
+            if self.strategy == "p2c" and len(candidates) > 2:
+                candidates = random.sample(candidates, 2)
+            backend = min(candidates, key=Backend.score)
+            backend.in_flight += 1
+            return backend
+
+    def typical_latency(self):
+        """The median EWMA latency of the healthy nodes that have one, or 0.0. Call with the lock held."""
+        samples = sorted(b.ewma_latency for b in self.backends if b.healthy and b.ewma_latency)
+        return samples[len(samples) // 2] if samples else 0.0
+
+    def update_backends(self, urls):
+        """
+        Replaces the set of nodes. Nodes that stay keep their statistics and
+        in-flight counts; new ones start at the typical latency, so they are not
+        flooded as if they answered instantly.
+        """
+        with self.lock:
+            current = {backend.url: backend for backend in self.backends}
+            latency = self.typical_latency()
+            self.backends = [current.get(url) or Backend(url, latency) for url in urls]
+        print(f"API Gateway is balancing over {len(urls)} app nodes: {', '.join(urls)}")
+
+    def release(self, backend):
+        with self.lock:
+            backend.in_flight -= 1
+
+    def record_success(self, backend, latency):
+        with self.lock:
+            if backend.ewma_latency:
+                backend.ewma_latency = EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * backend.ewma_latency
+            else:
+                backend.ewma_latency = latency
+            backend.consecutive_failures = 0
+
+    def record_failure(self, backend):
+        with self.lock:
+            backend.consecutive_failures += 1
+            if backend.healthy and backend.consecutive_failures >= EJECT_AFTER_FAILURES:
+                backend.healthy = False
+                print(f"API Gateway ejected {backend.url} after {backend.consecutive_failures} consecutive failures")
+
+    def health_check_daemon(self):
+        """Probes ejected nodes and returns them to rotation once they respond."""
+        while True:
+            time.sleep(HEALTH_CHECK_INTERVAL)
+            for backend in [b for b in self.backends if not b.healthy]:
+                try:
+                    response = node_session(backend.url).get(f"{backend.url}{HEALTH_CHECK_PATH}", timeout=1)
+                    response.close()
+                    alive = response.status_code < 500
+                except requests.exceptions.RequestException:
+                    alive = False
+                if alive:
+                    with self.lock:
+                        # Its old latency is stale; start it where the rest of the pool is.
+                        backend.ewma_latency = self.typical_latency()
+                        backend.healthy = True
+                        backend.consecutive_failures = 0
+                    print(f"API Gateway restored {backend.url} to rotation")
+
+
+balancer = LoadBalancer(APP_NODE_URLS)
+
+# --- Cluster Membership ---
+def join_cluster(port=GATEWAY_PORT):
+    """Starts gossiping as the gateway on port and keeps the balancer in step with the app nodes that are up."""
+    def on_membership_change(view):
+        nodes = view.alive("app_node") or view.members("app_node")
+        balancer.update_backends([f"http://{node['host']}:{node['port']}" for node in nodes])
+    membership = Membership("api_gateway", GATEWAY_HOST, port)
+    membership.add_listener(on_membership_change)
+    return membership
+
+# --- Header Forwarding ---
+def forwardable_headers(headers):
+    """Returns the end-to-end headers from a header collection."""
+    return [(name, value) for (name, value) in headers.items() if name.lower() not in HOP_BY_HOP_HEADERS]
@@ -0,0 +1,222 @@
+import json
+import os
+import random
+import socket
+import threading
+import time
+
+# --- Default Configuration ---
+CLUSTER_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cluster.json")
+GOSSIP_INTERVAL = 1      # Seconds between gossip rounds
+GOSSIP_FANOUT = 2        # Members each round is sent to
+SUSPECT_AFTER = 3        # Seconds without a fresher heartbeat before a member is suspected
+DEAD_AFTER = 10          # Seconds without a fresher heartbeat before a member is considered down
+MAX_DATAGRAM = 64 * 1024
+
+
+def load_cluster_config(path=CLUSTER_CONFIG):
+    """Reads the cluster topology: {role: [member, ...]}, each member a dict with at least host and port."""
+    with open(path) as config_file:
+        return json.load(config_file)
+
+def member_id(role, host, port):
+    return f"{role}:{host}:{port}"
+
+def config_members(config):
+    """Flattens a topology into {member id: member}, each member tagged with its role and id."""
+    members = {}
+    for role, entries in config.items():
+        for entry in entries:
+            member = dict(entry, role=role, id=member_id(role, entry["host"], entry["port"]))
+            members[member["id"]] = member
+    return members
+
+
+class Membership:
+    """
+    Who is in the cluster, and who is up, as seen by one member.
+
+    The topology comes from cluster.json, which is re-read whenever it
+    changes: adding an entry brings a node in, removing one takes it out.
+    Liveness comes from gossip. Every GOSSIP_INTERVAL each member bumps its
+    own heartbeat and sends its whole table over UDP to a few random members;
+    tables merge by keeping the highest heartbeat per member. A member whose
+    heartbeat stops advancing is suspect after SUSPECT_AFTER seconds and down
+    after DEAD_AFTER. Members also learn of each other through gossip, so a
+    node only needs one live member listed in its own copy of the file.
+
+    A member removed from the file is kept as a tombstone: it is gossiped as
+    removed, every member that hears so drops it too, and gossip about it is
+    ignored from then on, so peers that have not yet seen the change (or the
+    removed node itself) cannot bring it back. Listing it again revives it.
+    """
+    def __init__(self, role, host, port, config_path=CLUSTER_CONFIG,
+                 interval=GOSSIP_INTERVAL, fanout=GOSSIP_FANOUT):
+        self.id = member_id(role, host, port)
+        self.config_path = config_path
+        self.config_mtime = None
+        self.interval = interval
+        self.fanout = fanout
+        self.lock = threading.Lock()
+        self.table = {}      # member id -> {"member": {...}, "heartbeat": n, "left": bool, "seen": monotonic time}
+        self.removed = set() # member ids dropped from the topology; their table entries are tombstones
+        self.listeners = []
+        self.reload_config()
+        if self.id not in self.table:
+            raise ValueError(f"{self.id} is not listed in {config_path}")
+        self.me = self.table[self.id]
+        self.me["heartbeat"] = int(time.time() * 1000) # Fresher than anything gossiped before a restart
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, self.me["member"]["gossip_port"]))
+        self.last_view = self.view()
+        threading.Thread(target=self.receive_daemon, daemon=True).start()
+        threading.Thread(target=self.gossip_daemon, daemon=True).start()
+
+    # --- Queries ---
+    def member(self):
+        """This process's own entry."""
+        return self.me["member"]
+
+    def members(self, role):
+        """Every member of role that has not left, including ones that are currently down."""
+        with self.lock:
+            return sorted((entry["member"] for entry in self.table.values()
+                           if entry["member"]["role"] == role and not entry["left"]), key=lambda m: m["id"])
+
+    def alive(self, role):
+        """The members of role that are up, this process included."""
+        now = time.monotonic()
+        with self.lock:
+            return sorted((entry["member"] for entry in self.table.values()
+                           if entry["member"]["role"] == role and not entry["left"]
+                           and (entry is self.me or now - entry["seen"] < DEAD_AFTER)), key=lambda m: m["id"])
+
+    def status(self):
+        """{member id: "alive" | "suspect" | "dead" | "left"}, for diagnostics."""
+        now = time.monotonic()
+        statuses = {}
+        with self.lock:
+            for member, entry in self.table.items():
+                age = 0 if entry is self.me else now - entry["seen"]
+                statuses[member] = ("left" if entry["left"] else "dead" if age >= DEAD_AFTER
+                                    else "suspect" if age >= SUSPECT_AFTER else "alive")
+        return statuses
+
+    def add_listener(self, callback):
+        """Calls callback(membership) whenever a member joins, leaves, goes down or comes back up."""
+        self.listeners.append(callback)
+
+    def leave(self):
+        """Tells the cluster this member is shutting down, so nobody waits for it to time out."""
+        with self.lock:
+            self.me["left"] = True
+            self.me["heartbeat"] += 1
+        for entry in self.gossip_targets(len(self.table)):
+            self.send(entry)
+
+    # --- Topology file ---
+    def reload_config(self):
+        try:
+            mtime = os.path.getmtime(self.config_path)
+            if mtime == self.config_mtime:
+                return
+            configured = config_members(load_cluster_config(self.config_path))
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] Membership: could not read {self.config_path}: {e}")
+            return
+        now = time.monotonic()
+        with self.lock:
+            if self.config_mtime is not None:
+                for removed in set(self.table) - set(configured) - self.removed - {self.id}:
+                    print(f"[*] Membership: {removed} was removed from {self.config_path}")
+                    self.tombstone(removed)
+            for mid, member in configured.items():
+                if mid not in self.table:
+                    # Never heard from yet: counts as up until DEAD_AFTER passes without a heartbeat.
+                    self.table[mid] = {"member": member, "heartbeat": 0, "left": False, "seen": now}
+                else:
+                    self.table[mid]["member"] = member
+                if mid in self.removed:
+                    print(f"[*] Membership: {mid} was added back to {self.config_path}")
+                    self.removed.discard(mid)
+                    self.table[mid].update(left=False, seen=now)
+        self.config_mtime = mtime
+
+    def tombstone(self, mid, heartbeat=0):
+        """Marks a member as removed from the topology. Caller holds the lock."""
+        entry = self.table[mid]
+        self.removed.add(mid)
+        # Newer than anything gossiped about it so far, so peers take the removal over their copy.
+        entry.update(left=True, heartbeat=max(entry["heartbeat"], heartbeat) + 1)
+
+    # --- Gossip ---
+    def gossip_targets(self, count):
+        with self.lock:
+            others = [entry for mid, entry in self.table.items() if mid != self.id and not entry["left"]]
+        return random.sample(others, min(count, len(others)))
+
+    def send(self, entry):
+        with self.lock:
+            digest = {mid: {"member": e["member"], "heartbeat": e["heartbeat"], "left": e["left"],
+                            "removed": mid in self.removed}
+                      for mid, e in self.table.items()}
+        payload = json.dumps({"from": self.id, "members": digest}).encode()
+        target = entry["member"]
+        try:
+            self.sock.sendto(payload, (target["host"], target["gossip_port"]))
+        except OSError:
+            pass # Unreachable members simply stop refreshing their heartbeat
+
+    def gossip_daemon(self):
+        while True:
+            time.sleep(self.interval)
+            self.reload_config()
+            with self.lock:
+                self.me["heartbeat"] += 1
+            for entry in self.gossip_targets(self.fanout):
+                self.send(entry)
+            self.notify_if_changed()
+
+    def receive_daemon(self):
+        while True:
+            try:
+                payload, _ = self.sock.recvfrom(MAX_DATAGRAM)
+                members = json.loads(payload)["members"]
+            except (OSError, ValueError, KeyError):
+                continue
+            now = time.monotonic()
+            with self.lock:
+                for mid, remote in members.items():
+                    if mid == self.id or mid in self.removed:
+                        continue
+                    local = self.table.get(mid)
+                    if remote.get("removed"):
+                        if local is None:
+                            self.table[mid] = local = {"member": remote["member"], "heartbeat": remote["heartbeat"],
+                                                       "left": True, "seen": now}
+                        print(f"[*] Membership: learned through gossip that {mid} was removed")
+                        self.tombstone(mid, remote["heartbeat"])
+                    elif local is None:
+                        print(f"[*] Membership: learned of {mid} through gossip")
+                        self.table[mid] = {"member": remote["member"], "heartbeat": remote["heartbeat"],
+                                           "left": remote["left"], "seen": now}
+                    elif remote["heartbeat"] > local["heartbeat"]:
+                        local.update(heartbeat=remote["heartbeat"], left=remote["left"], seen=now)
+            self.notify_if_changed()
+
+    def view(self):
+        statuses = self.status()
+        return {mid: status for mid, status in statuses.items() if status in ("alive", "suspect")}
+
+    def notify_if_changed(self):
+        view = self.view()
+        with self.lock:
+            changed = view.keys() != self.last_view.keys()
+            self.last_view = view
+        if changed:
+            print(f"[*] Membership: {len(view)} members up: {', '.join(sorted(view))}")
+            for callback in self.listeners:
+                try:
+                    callback(self)
+                except Exception as e:
+                    print(f"[ERROR] Membership listener failed: {e}")
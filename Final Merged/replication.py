@@ -0,0 +1,263 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Default Configuration ---
+DEFAULT_TIMEOUT = 5          # Seconds a writer waits for its quorum before giving up
+DEFAULT_HINT_BATCH = 200     # Missed writes replayed to a peer per RPC
+DEFAULT_BASE_BACKOFF = 1     # Seconds before the first retry of an unreachable peer
+DEFAULT_MAX_BACKOFF = 60     # Ceiling for the exponential retry delay
+DEFAULT_MAX_IN_FLIGHT = 4    # Sends allowed to wait on one peer at once; further ones become hints
+
+
+class ReplicationEngine:
+    """
+    Fans replicate_write messages out to the peers on a long-lived worker pool
+    and reports success as soon as the write quorum is reached.
+
+    Peers that answer after the quorum keep running in the background, so write
+    latency follows the fastest replicas rather than the slowest one. At most
+    max_in_flight sends wait on any one peer; messages beyond that count as
+    missed by the peer straight away (on_failure hands them to hinted handoff),
+    so a stalled replica cannot take over the pool and delay everyone else's acks.
+    """
+    def __init__(self, peers, send, quorum, workers=None, timeout=DEFAULT_TIMEOUT, on_failure=None,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        self.peers = list(peers)
+        self.send = send # send(peer, message) -> response dict; should give up after timeout seconds
+        self.quorum = quorum
+        self.timeout = timeout
+        self.on_failure = on_failure # on_failure(peer, message), called for every peer that did not ack
+        self.max_in_flight = max_in_flight
+        self.fixed_workers = workers
+        self.slots = {}  # peer -> semaphore counting the sends it may still take
+        self.lock = threading.Lock()
+        self.workers = self.pool_size(self.peers)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="replication")
+
+    def pool_size(self, peers):
+        return self.fixed_workers or max(4, self.max_in_flight * len(peers))
+
+    def set_peers(self, peers):
+        """Replaces the peer set. Calls already in progress finish against the old one."""
+        self.peers = list(peers)
+        with self.lock:
+            if self.pool_size(self.peers) > self.workers:
+                # Sends already queued on the old pool still run; it shuts down once they are done.
+                self.workers = self.pool_size(self.peers)
+                old, self.executor = self.executor, ThreadPoolExecutor(max_workers=self.workers,
+                                                                       thread_name_prefix="replication")
+                old.shutdown(wait=False)
+
+    def dispatch(self, peer, message, on_reply):
+        """
+        Sends message to peer on the pool and calls on_reply(peer, response), with
+        None if the send failed, or at once if peer already has max_in_flight sends waiting.
+        """
+        with self.lock:
+            slots = self.slots.setdefault(peer, threading.BoundedSemaphore(self.max_in_flight))
+            executor = self.executor
+        if not slots.acquire(blocking=False):
+            on_reply(peer, None)
+            return
+
+        def send():
+            try:
+                return self.send(peer, message)
+            finally:
+                slots.release()
+
+        def done(future):
+            try:
+                response = future.result()
+            except Exception:
+                response = None
+            on_reply(peer, response)
+
+        try:
+            future = executor.submit(send)
+        except RuntimeError:
+            # set_peers swapped the pool between picking it and submitting.
+            future = self.executor.submit(send)
+        future.add_done_callback(done)
+
+    def replicate(self, message, local_acks=1, peers=None):
+        """
+        Sends message to every peer, or to peers when given. Returns (success, acks)
+        where acks counts the local write plus the peers that had acknowledged when
+        the call returned.
+        """
+        peers = self.peers if peers is None else peers
+        lock = threading.Lock()
+        decided = threading.Event()
+        state = {"acks": local_acks, "pending": len(peers)}
+        if state["acks"] >= self.quorum or not peers:
+            decided.set()
+
+        def on_reply(peer, response):
+            acked = bool(response) and response.get("status") == "success"
+            if not acked and self.on_failure is not None:
+                self.on_failure(peer, message)
+            with lock:
+                state["pending"] -= 1
+                if acked:
+                    state["acks"] += 1
+                if state["acks"] >= self.quorum or state["pending"] == 0:
+                    decided.set()
+
+        for peer in peers:
+            self.dispatch(peer, message, on_reply)
+
+        decided.wait(self.timeout)
+        with lock:
+            acks = state["acks"]
+        return acks >= self.quorum, acks
+
+    def read(self, message, local_response, quorum, digest, peers=None):
+        """
+        Sends a read to every peer, or to peers when given, and returns as soon as
+        quorum replies, the local one included, have the same digest(response).
+        local_response is None when this node does not hold the data itself.
+        Asking every peer rather than just quorum - 1 of them hedges against the
+        slowest replica.
+
+        Returns (agreed, replies): agreed is the response the quorum matched on, or
+        None; replies maps each peer that answered by then to its response, with
+        the local response under None.
+        """
+        peers = self.peers if peers is None else peers
+        lock = threading.Lock()
+        decided = threading.Event()
+        replies = {} if local_response is None else {None: local_response}
+        tally = {} if local_response is None else {digest(local_response): 1}
+        state = {"agreed": local_response if quorum <= 1 else None, "pending": len(peers)}
+        if state["agreed"] is not None or not peers:
+            decided.set()
+
+        def on_reply(peer, response):
+            with lock:
+                state["pending"] -= 1
+                if response and response.get("status") == "success" and not decided.is_set():
+                    replies[peer] = response
+                    key = digest(response)
+                    tally[key] = tally.get(key, 0) + 1
+                    if tally[key] >= quorum:
+                        state["agreed"] = response
+                if state["agreed"] is not None or state["pending"] == 0:
+                    decided.set()
+
+        for peer in peers:
+            self.dispatch(peer, message, on_reply)
+
+        decided.wait(self.timeout)
+        with lock:
+            decided.set() # Replies that arrive after the decision are no longer recorded
+            return state["agreed"], dict(replies)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class HintedHandoff:
+    """
+    A durable, per-peer backlog of replicate_write messages that a peer missed.
+
+    Missed writes are appended to a small SQLite file next to the node's
+    database. A background thread replays them in batches, oldest first, with
+    exponential backoff per peer, until the peer has caught up. Replays are
+    idempotent because replicated writes are INSERT OR REPLACE.
+    """
+    def __init__(self, path, peers, send, batch_size=DEFAULT_HINT_BATCH,
+                 base_backoff=DEFAULT_BASE_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF):
+        self.peers = {self.peer_key(peer): peer for peer in peers}
+        self.send = send
+        self.batch_size = batch_size
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.failures = {key: 0 for key in self.peers}
+        self.next_attempt = {key: 0.0 for key in self.peers}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS hints (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, peer TEXT NOT NULL,
+                message TEXT NOT NULL, created REAL NOT NULL
+            )''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_hints_peer ON hints (peer, id)")
+        self.conn.commit()
+        drainer = threading.Thread(target=self.drain_daemon, daemon=True)
+        drainer.start()
+
+    def set_peers(self, peers):
+        """
+        Replaces the peer set. Hints for a peer that is no longer listed are kept
+        and replayed if it comes back.
+        """
+        peers = {self.peer_key(peer): peer for peer in peers}
+        for key in peers:
+            self.failures.setdefault(key, 0)
+            self.next_attempt.setdefault(key, 0.0)
+        self.peers = peers
+        self.wakeup.set()
+
+    @staticmethod
+    def peer_key(peer):
+        return f"{peer[0]}:{peer[1]}"
+
+    def store(self, peer, message):
+        """Records a write the peer did not acknowledge. Safe to call from any thread."""
+        key = self.peer_key(peer)
+        with self.lock:
+            self.conn.execute("INSERT INTO hints (peer, message, created) VALUES (?, ?, ?)",
+                              (key, json.dumps(message["data"]), time.time()))
+            self.conn.commit()
+        self.wakeup.set()
+
+    def backlog(self):
+        """Returns the number of writes waiting for each peer."""
+        with self.lock:
+            rows = self.conn.execute("SELECT peer, COUNT(*) FROM hints GROUP BY peer").fetchall()
+        return dict(rows)
+
+    def drain_daemon(self):
+        while True:
+            self.wakeup.wait(self.base_backoff)
+            self.wakeup.clear()
+            for key in list(self.peers):
+                if time.time() >= self.next_attempt[key]:
+                    self.drain_peer(key)
+
+    def drain_peer(self, key):
+        """Replays the peer's backlog batch by batch until it is empty or the peer fails."""
+        peer = self.peers.get(key)
+        if peer is None:
+            return
+        while True:
+            with self.lock:
+                rows = self.conn.execute("SELECT id, message FROM hints WHERE peer = ? ORDER BY id LIMIT ?",
+                                         (key, self.batch_size)).fetchall()
+            if not rows:
+                return
+            writes = [json.loads(message) for _, message in rows]
+            response = self.send(peer, {"action": "replicate_write_batch", "data": {"writes": writes}})
+            if response and 400 <= response.get("code", 0) < 500:
+                # The peer refused the batch itself; resending it would only block the hints behind it.
+                print(f"[WARNING] Hinted handoff: {key} refused {len(rows)} missed writes, dropping them: "
+                      f"{response.get('error') or response.get('message')}")
+            elif not response or response.get("status") != "success":
+                self.failures[key] += 1
+                delay = min(self.max_backoff, self.base_backoff * 2 ** self.failures[key])
+                self.next_attempt[key] = time.time() + delay * random.uniform(0.5, 1.0)
+                return
+            with self.lock:
+                self.conn.execute("DELETE FROM hints WHERE peer = ? AND id <= ?", (key, rows[-1][0]))
+                self.conn.commit()
+            self.failures[key] = 0
+            if response.get("status") == "success":
+                print(f"[*] Hinted handoff: replayed {len(rows)} missed writes to {key}")
@@ -0,0 +1,137 @@
+import threading
+import time
+import xmlrpc.client
+from contextlib import contextmanager
+import binary_rpc
+
+# --- Default Pool Configuration ---
+DEFAULT_POOL_SIZE = 8        # Max open connections to a single node
+DEFAULT_IDLE_TIMEOUT = 10    # Seconds an unused connection is kept; below the data node's keep-alive timeout
+
+# "xmlrpc" always uses XML-RPC, "binary" requires the framed msgpack transport,
+# and "auto" asks each node what it supports and prefers binary when offered.
+DEFAULT_PROTOCOL = "auto"
+
+
+class RPCConnectionPool:
+    """
+    A thread-safe pool of keep-alive XML-RPC connections to one node.
+
+    Each pooled ServerProxy owns its own xmlrpc.client.Transport, which keeps a
+    single HTTP/1.1 connection open between calls. A proxy is only ever used by
+    one thread at a time; it is checked out, used, and handed back.
+    """
+    def __init__(self, host, port, max_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.url = f"http://{host}:{port}/"
+        self.idle_timeout = idle_timeout
+        self.idle = []  # (proxy, last_used) pairs, most recently used last
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_size)
+
+    def _new_proxy(self):
+        return xmlrpc.client.ServerProxy(self.url, transport=xmlrpc.client.Transport(), allow_none=True)
+
+    def _evict_idle(self, now):
+        """Closes connections that have sat unused for longer than idle_timeout. Caller holds the lock."""
+        fresh = []
+        for proxy, last_used in self.idle:
+            if now - last_used > self.idle_timeout:
+                proxy("close")()
+            else:
+                fresh.append((proxy, last_used))
+        self.idle = fresh
+
+    @contextmanager
+    def connection(self):
+        """Checks out a proxy for the duration of the block, reusing an idle connection when there is one."""
+        self.slots.acquire()
+        proxy = None
+        reusable = False
+        try:
+            with self.lock:
+                self._evict_idle(time.time())
+                if self.idle:
+                    proxy, _ = self.idle.pop()
+            if proxy is None:
+                proxy = self._new_proxy()
+            try:
+                yield proxy
+                reusable = True
+            except xmlrpc.client.Fault:
+                # A Fault is a complete response, so the connection is still in a clean state.
+                reusable = True
+                raise
+        finally:
+            if proxy is not None:
+                if reusable:
+                    with self.lock:
+                        self.idle.append((proxy, time.time()))
+                else:
+                    # The connection may be half-way through a request; never reuse it.
+                    proxy("close")()
+            self.slots.release()
+
+    def close(self):
+        with self.lock:
+            for proxy, _ in self.idle:
+                proxy("close")()
+            self.idle = []
+
+
+class NodeRPCClient:
+    """
+    Calls dispatch_rpc(action, data) on one node over the best protocol it offers.
+
+    XML-RPC always works. With protocol "auto" the first call asks the node's
+    XML-RPC endpoint for rpc_capabilities(); nodes that advertise the binary
+    transport are then reached over a persistent multiplexed msgpack connection,
+    so old and new nodes can run side by side during a rollout.
+    """
+    def __init__(self, host, port, protocol=DEFAULT_PROTOCOL, max_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.xmlrpc_pool = RPCConnectionPool(host, port, max_size, idle_timeout)
+        self.binary_client = None
+        self.negotiated = protocol == "xmlrpc"
+        self.lock = threading.Lock()
+
+    def _negotiate(self):
+        """Decides once which transport to use. Returns the binary client, or None for XML-RPC."""
+        with self.lock:
+            if self.negotiated:
+                return self.binary_client
+            binary_port = None
+            if binary_rpc.is_available():
+                if self.protocol == "binary":
+                    binary_port = self.port + binary_rpc.BINARY_PORT_OFFSET
+                else:
+                    try:
+                        with self.xmlrpc_pool.connection() as proxy:
+                            capabilities = proxy.rpc_capabilities()
+                        if "binary" in capabilities.get("protocols", []):
+                            binary_port = capabilities["binary_port"]
+                    except xmlrpc.client.Fault:
+                        pass # An older node without rpc_capabilities: stay on XML-RPC.
+            if binary_port is not None:
+                self.binary_client = binary_rpc.BinaryRPCClient(self.host, binary_port)
+            self.negotiated = True
+            return self.binary_client
+
+    def call(self, action, data, timeout=None):
+        """timeout, in seconds, bounds the wait for a binary reply; None keeps the client's default."""
+        binary_client = self._negotiate()
+        if binary_client is None:
+            with self.xmlrpc_pool.connection() as proxy:
+                return proxy.dispatch_rpc(action, data)
+        try:
+            return binary_client.call(action, data, timeout)
+        except ConnectionError:
+            # The node may have restarted without the binary transport; ask again next time.
+            if self.protocol == "auto":
+                with self.lock:
+                    self.negotiated = False
+                    self.binary_client = None
+            raise
@@ -29,6 +29,15 @@ echo Cleaning up old database files...
 if exist data_node_1.db del data_node_1.db
 if exist data_node_2.db del data_node_2.db
 if exist data_node_3.db del data_node_3.db
+if exist data_node_1.db-wal del data_node_1.db-wal
+if exist data_node_1.db-shm del data_node_1.db-shm
+if exist data_node_2.db-wal del data_node_2.db-wal
+if exist data_node_2.db-shm del data_node_2.db-shm
+if exist data_node_3.db-wal del data_node_3.db-wal
+if exist data_node_3.db-shm del data_node_3.db-shm
+if exist data_node_1.db.hints del data_node_1.db.hints
+if exist data_node_2.db.hints del data_node_2.db.hints
+if exist data_node_3.db.hints del data_node_3.db.hints
 echo Cleanup complete.
 echo.
 
@@ -0,0 +1,79 @@
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Default Configuration ---
+DEFAULT_WORKERS = 8        # Nodes queried at once
+MAX_CHUNK_SIZE = 500       # Rows asked of one node per call; matches the data nodes' page limit
+
+
+class NodeStream:
+    """
+    One node's rows in sort order, fetched a chunk at a time. The first chunk
+    is passed in, already fetched; later ones are asked for only when the merge
+    has consumed everything before them, resuming after the last row's sort key.
+    """
+    def __init__(self, node, fetch, request, sort_key, chunk_size, first_chunk):
+        self.node = node
+        self.fetch = fetch
+        self.request = request
+        self.sort_key = sort_key
+        self.chunk_size = chunk_size
+        self.first_chunk = first_chunk
+
+    def __iter__(self):
+        chunk = self.first_chunk
+        while True:
+            yield from chunk
+            if len(chunk) < self.chunk_size:
+                return
+            after = list(self.sort_key(chunk[-1]))
+            chunk = self.fetch(self.node, dict(self.request, after=after, limit=self.chunk_size))
+
+
+class ScatterGather:
+    """
+    Runs a sorted, paged query on many nodes and merges their answers.
+
+    Every node gets the same request, with the filters and limit pushed down,
+    so each returns at most one page of rows already sorted by sort_key. A
+    k-way heap merge walks the node streams in order, fetching further chunks
+    from a node only when the merge reaches the end of what it has. Rows that
+    several replicas returned share an identity; the one with the highest
+    version is kept.
+
+    fetch(node, request) returns a list of rows, or raises if the node failed.
+    """
+    def __init__(self, fetch, sort_key, identity, version, workers=DEFAULT_WORKERS):
+        self.fetch = fetch
+        self.sort_key = sort_key
+        self.identity = identity
+        self.version = version
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scatter")
+
+    def query(self, nodes, request, offset, limit):
+        """
+        Returns (rows, has_more, answered): the limit rows after the first offset
+        of the merged result, whether more follow, and the nodes that answered.
+        """
+        chunk_size = min(offset + limit + 1, MAX_CHUNK_SIZE)
+        first = dict(request, limit=chunk_size)
+        futures = {node: self.executor.submit(self.fetch, node, first) for node in nodes}
+        streams = []
+        for node, future in futures.items():
+            try:
+                rows = future.result()
+            except Exception as e:
+                print(f"[WARNING] Scatter-gather: node {node} failed: {e}")
+                continue
+            streams.append(NodeStream(node, self.fetch, request, self.sort_key, chunk_size, rows))
+
+        merged = heapq.merge(*streams, key=self.sort_key)
+        # Copies of one row from different replicas sort next to each other.
+        distinct = (max(copies, key=self.version)
+                    for _, copies in itertools.groupby(merged, key=self.identity_key))
+        page = list(itertools.islice(distinct, offset, offset + limit + 1))
+        return page[:limit], len(page) > limit, [stream.node for stream in streams]
+
+    def identity_key(self, row):
+        return self.sort_key(row), self.identity(row)
@@ -0,0 +1,110 @@
+import bisect
+import hashlib
+
+# --- Default Configuration ---
+VIRTUAL_NODES = 128       # Ring positions per data node; more positions spread ranges more evenly
+REPLICATION_FACTOR = 3    # Data nodes that hold each patient
+
+# Tables are placed by the patient they belong to. The usernames directory is
+# placed by username, so a login can find its patient's uuid first.
+SHARD_COLUMNS = {"users": "uuid", "records": "patient_uuid", "usernames": "username"}
+
+
+def ring_hash(value):
+    """A 64-bit position on the ring."""
+    return int(hashlib.md5(str(value).encode()).hexdigest()[:16], 16)
+
+def in_ranges(position, ranges):
+    """True when position falls in one of the (start, end] arcs; an arc with start >= end wraps past zero."""
+    for start, end in ranges:
+        if start < end:
+            if start < position <= end:
+                return True
+        elif position > start or position <= end:
+            return True
+    return False
+
+def encode_ranges(ranges):
+    """Arcs as hex strings, since XML-RPC integers stop at 32 bits."""
+    return [[f"{start:016x}", f"{end:016x}"] for start, end in ranges]
+
+def decode_ranges(ranges):
+    return [(int(start, 16), int(end, 16)) for start, end in ranges]
+
+
+class HashRing:
+    """
+    A consistent-hash ring of data nodes, each a (host, port) tuple.
+
+    Every node sits at VIRTUAL_NODES points on the ring. A key is owned by the
+    first replication_factor distinct nodes found walking clockwise from the
+    key's hash, so adding or removing a node only moves the arcs next to its
+    points; everything else stays where it was.
+    """
+    def __init__(self, nodes, vnodes=VIRTUAL_NODES, replication_factor=REPLICATION_FACTOR):
+        self.nodes = sorted({tuple(node) for node in nodes})
+        self.replication_factor = min(replication_factor, len(self.nodes))
+        points = sorted((ring_hash(f"{host}:{port}#{i}"), (host, port)) for host, port in self.nodes for i in range(vnodes))
+        self.positions = [position for position, _ in points]
+        self.points = [node for _, node in points]
+
+    def owners_at(self, index):
+        """The replica set of the arc that ends at point index."""
+        owners = []
+        for offset in range(len(self.points)):
+            node = self.points[(index + offset) % len(self.points)]
+            if node not in owners:
+                owners.append(node)
+                if len(owners) == self.replication_factor:
+                    break
+        return owners
+
+    def owners(self, key):
+        """The nodes that hold key, its primary first."""
+        if not self.points:
+            return []
+        return self.owners_at(bisect.bisect_left(self.positions, ring_hash(key)) % len(self.points))
+
+    def covered(self, nodes):
+        """True when every arc has at least one owner among nodes."""
+        nodes = set(nodes)
+        return all(nodes.intersection(owners) for _, _, owners in self.arcs())
+
+    def arcs(self):
+        """Yields (start, end, owners) for every arc between consecutive points."""
+        for index in range(len(self.points)):
+            yield self.positions[index - 1], self.positions[index], self.owners_at(index)
+
+    def takeovers(self, previous, node, available=None):
+        """
+        The arcs node owns on this ring but did not own on previous, grouped by
+        a node that did own them, preferring nodes in available:
+        {source: [(start, end), ...]}. Arcs that no node owned before are left out.
+        """
+        sources = {}
+        for start, end, owners in self.arcs():
+            if node not in owners:
+                continue
+            # Both rings cut the circle at different points, so ask the old ring about each part of the arc.
+            for part_start, part_end, old_owners in previous.split(start, end):
+                if node in old_owners or not old_owners:
+                    continue
+                source = next((owner for owner in old_owners if available is None or owner in available), old_owners[0])
+                parts = sources.setdefault(source, [])
+                if parts and parts[-1][1] == part_start:
+                    parts[-1] = (parts[-1][0], part_end)
+                else:
+                    parts.append((part_start, part_end))
+        return sources
+
+    def split(self, start, end):
+        """Cuts the (start, end] arc at this ring's points. Yields (start, end, owners) for each piece."""
+        if not self.points:
+            yield start, end, []
+            return
+        cuts = [position for position in self.positions if in_ranges(position, [(start, end)]) and position != end]
+        cuts.sort(key=lambda position: (position - start) % 2 ** 64)
+        for cut in cuts + [end]:
+            # Every position in (start, cut] maps to the first point at or after cut.
+            yield start, cut, self.owners_at(bisect.bisect_left(self.positions, cut) % len(self.points))
+            start = cut
@@ -0,0 +1,65 @@
+import threading
+import unittest
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from cache import TwoTierCache, LocalCache
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class InvalidationRaceTest(unittest.TestCase):
+    """A fill that read the source before a write must not cache its page after the write's delete()."""
+
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=server)
+        # Two App Nodes sharing one Redis.
+        self.node_a = TwoTierCache(fakeredis.FakeRedis(server=server), LocalCache(), load_lock_ttl_ms=0)
+        self.node_b = TwoTierCache(fakeredis.FakeRedis(server=server), LocalCache(), load_lock_ttl_ms=0)
+
+    def stale_loader(self):
+        """Reads the old page, then a write on the other node lands before the page is stored."""
+        page = ["old record"]
+        self.node_b.delete("records:p1")
+        return page, True
+
+    def test_load_racing_delete_is_not_cached(self):
+        self.assertEqual(self.node_a.load("records:p1", "first:50", self.stale_loader), ["old record"])
+        self.assertIsNone(self.redis.hget("records:p1", "first:50"))
+        self.assertIsNone(self.node_a.get("records:p1", "first:50"))
+        self.assertIsNone(self.node_b.get("records:p1", "first:50"))
+
+    def test_refresh_racing_delete_is_not_cached(self):
+        self.node_a.set("records:p1", "first:50", ["older record"])
+        self.node_a.refresh("records:p1", "first:50", self.stale_loader, float("inf"))
+        self.assertIsNone(self.redis.hget("records:p1", "first:50"))
+        self.assertIsNone(self.node_b.get("records:p1", "first:50"))
+
+    def test_set_with_snapshot_racing_delete_is_not_cached(self):
+        snapshot = self.node_a.snapshot("user_data:ann")
+        self.node_b.delete("user_data:ann")
+        self.node_a.set("user_data:ann", "first:50", {"records": []}, snapshot)
+        self.assertIsNone(self.node_b.get("user_data:ann", "first:50"))
+        self.assertIsNone(self.node_a.get("user_data:ann", "first:50"))
+
+    def test_load_without_a_write_is_cached_for_every_node(self):
+        self.node_a.load("records:p1", "first:50", lambda: (["new record"], True))
+        self.assertEqual(self.node_b.get("records:p1", "first:50"), ["new record"])
+        self.assertGreater(self.redis.ttl("records:p1"), 0)
+
+    def test_concurrent_fills_after_a_delete_are_cached(self):
+        self.node_b.delete("records:p1")
+        threads = [threading.Thread(target=self.node_a.load, args=("records:p1", "first:50", lambda: (["new record"], True)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.node_b.get("records:p1", "first:50"), ["new record"])
+
+
+if __name__ == '__main__':
+    unittest.main()